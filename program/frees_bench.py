@@ -0,0 +1,319 @@
+# FreES benchmarks.
+# Run from the program folder:
+#
+#     python frees_bench.py import
+#     python frees_bench.py run --save bench_baseline.json
+#     python frees_bench.py run --compare bench_baseline.json
+#     python frees_bench.py corpus models --sizes 100 1000
+
+from argparse import ArgumentParser
+from json import load, dump
+from math import log
+from os import makedirs, path
+from platform import python_version
+from subprocess import run
+from sys import executable, exit
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+
+
+IMPORT_BUDGET = 0.050 # seconds allowed for a cold 'import frees_lib2'
+SIZES = [10, 100, 1000]
+TOLERANCE = 0.5 # fraction a time or peak memory may grow over its baseline before it counts as a regression
+UNIT_PAIRS = [("ft", "m"), ("in", "mm"), ("lbm", "kg"), ("hr", "s"), ("mph", "m/s"), ("psi", "kPa"), ("Btu", "kJ"), ("gal", "l")]
+
+
+def import_time(module="frees_lib2", repeats=5):
+    """Returns the best of several cold import times of a module, each measured in a fresh interpreter."""
+    here = path.dirname(path.abspath(__file__))
+    code = f"from time import perf_counter; t = perf_counter(); import {module}; print(perf_counter() - t)"
+
+    times = [float(run([executable, "-c", code], cwd=here, capture_output=True, text=True, check=True).stdout) for i in range(repeats)]
+    return min(times)
+
+
+def chain_model(n:int):
+    """A chain of n implicit equations, each needing the one below it, so the file reads in the reverse of solving order."""
+    lines = [f"x{i} + sin(x{i}) = x{i-1}^2/(1 + x{i-1}) + 1" for i in range(n - 1, 0, -1)]
+    return "\n".join(lines + ["x0 = 2"])
+
+
+def poly_model(n:int):
+    """n cubics with three real roots each (near 1, 2 and 3), picked apart with '!bound'."""
+    lines = []
+    for i in range(n):
+        lo = 0.5 + i % 3
+        lines += [f"p{i} = {6 + 0.05*(i % 7 - 3):.2f}", f"p{i} = r{i}^3 - 6*r{i}^2 + 11*r{i} !bound r{i} {lo} {lo + 1}"]
+    return "\n".join(lines)
+
+
+def convert_model(n:int):
+    """n unit conversions, cycling through a few unit pairs."""
+    lines = []
+    for i in range(n):
+        a, b = UNIT_PAIRS[i % len(UNIT_PAIRS)]
+        lines += [f"u{i} = {i + 1} * convert('{a}','{b}')"]
+    return "\n".join(lines)
+
+
+def flags_model(n:int):
+    """n groups of '!bound' and '!if' lines, half of the conditions left unsatisfied."""
+    lines = []
+    for i in range(n):
+        lines += [
+            f"a{i} = {i % 10}",
+            f"t{i}^2 = a{i} + 4 !bound t{i} 0 100",
+            f"s{i} = t{i} !if a{i} < 5",
+            f"s{i} = -t{i} !if a{i} >= 5"
+        ]
+    return "\n".join(lines)
+
+
+def constants_model(n:int):
+    """n equations leaning on '&' constants."""
+    lines = []
+    for i in range(n):
+        lines += [f"m{i} = {i + 1}", f"w{i} = m{i} * &g", f"e{i} * &pi = w{i} * &NA / 1E23"]
+    return "\n".join(lines)
+
+
+def powers_model(n:int):
+    """n fractional powers, solved for a base the root finders also try on the negative side (where the power is complex)."""
+    lines = []
+    for i in range(n):
+        lines += [f"y{i} = {i % 5 + 2}", f"y{i} = x{i}^0.5", f"y{i} = d{i}^1.5 + 1", f"y{i} = c{i}^(1/3)"]
+    return "\n".join(lines)
+
+
+def mixed_model(n:int):
+    """A bit of everything, in roughly the proportions of a real model."""
+    k = max(n // 5, 1)
+    parts = [chain_model(k), poly_model(k), convert_model(k), flags_model(k), constants_model(k)]
+    return "\n\n".join(parts)
+
+
+corpus = {
+    "chain": chain_model,
+    "poly": poly_model,
+    "convert": convert_model,
+    "flags": flags_model,
+    "constants": constants_model,
+    "powers": powers_model,
+    "mixed": mixed_model
+}
+
+
+def write_corpus(folder:str, sizes=SIZES, cases=corpus):
+    """Write each model at each size to 'folder' as .fr files, e.g. for timing the command line runner."""
+    makedirs(folder, exist_ok=True)
+    files = []
+
+    for name in cases:
+        for n in sizes:
+            fp = path.join(folder, f"{name}_{n}.fr")
+            with open(fp, "w") as f:
+                f.write(cases[name](n) + "\n")
+            files += [fp]
+
+    return files
+
+
+def time_solve(text:str, accuracy=1E-320, repeats=3):
+    """Returns the best time of several parses and solves of a system, and the number of equations in it."""
+    from frees_lib2 import frees
+
+    best = float("inf")
+    for i in range(repeats):
+        t = perf_counter()
+        system = frees(text, accuracy)
+        system.solve()
+        best = min(best, perf_counter() - t)
+
+    return best, len(system.stats)
+
+
+def peak_memory(text:str, accuracy=1E-320):
+    """Returns the most memory (in bytes) allocated at once while parsing and solving a system."""
+    from frees_lib2 import frees
+
+    tracemalloc.start()
+    try:
+        system = frees(text, accuracy)
+        system.solve()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def load_benchmarks(sizes=SIZES, repeats=3, memory=True):
+    """Times loading (parsing and graphing, without solving) the mixed model from a file at each size, 
+    with the peak memory of the load."""
+    from frees_lib2 import frees
+
+    results = {}
+    with TemporaryDirectory() as folder:
+        for fp, n in zip(write_corpus(folder, sizes, {"mixed": mixed_model}), sizes):
+            best = float("inf")
+            for i in range(repeats):
+                t = perf_counter()
+                system = frees.from_file(fp)
+                best = min(best, perf_counter() - t)
+
+            case = {"seconds": best, "equations": len(system.graph.needs), "eqns_per_s": len(system.graph.needs) / best}
+            if memory:
+                tracemalloc.start()
+                try:
+                    frees.from_file(fp)
+                    case["peak_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+                finally:
+                    tracemalloc.stop()
+            results[f"load/{n}"] = case
+
+    return results
+
+
+def time_calls(f, args:list, repeats=3):
+    """Returns the best time per call of f over a list of argument tuples."""
+    best = float("inf")
+    for i in range(repeats):
+        t = perf_counter()
+        for a in args:
+            f(*a)
+        best = min(best, perf_counter() - t)
+
+    return best / len(args)
+
+
+def micro_benchmarks():
+    """Times the pieces every solve leans on: a lone root find and a unit conversion."""
+    from frees_lib2 import iter_solve, convert, registry
+
+    registry.refresh()
+    roots = [(f"x**3 - 12*x + {c}", 0, "x", {}, 0, 10) for c in range(1, 21)]
+    conversions = [UNIT_PAIRS[i % len(UNIT_PAIRS)] for i in range(1000)]
+
+    return {
+        "iter_solve": {"seconds": time_calls(iter_solve, roots)},
+        "convert": {"seconds": time_calls(convert, conversions)}
+    }
+
+
+def scaling(times:dict):
+    """Estimates k in 'time ~ N^k' from the smallest and largest sizes timed."""
+    sizes = sorted(times)
+    if len(sizes) < 2 or times[sizes[0]] <= 0:
+        return None
+    return log(times[sizes[-1]] / times[sizes[0]]) / log(sizes[-1] / sizes[0])
+
+
+def run_benchmarks(sizes=SIZES, cases=corpus, repeats=3, memory=True):
+    """Times each model at each size. Returns a dict of results that can be saved as a baseline."""
+    results = {"python": python_version(), "sizes": list(sizes), "cases": {}, "scaling": {}}
+
+    for name in cases:
+        times = {}
+        for n in sizes:
+            text = cases[name](n)
+            seconds, eqns = time_solve(text, repeats=repeats)
+            case = {"seconds": seconds, "equations": eqns, "eqns_per_s": eqns / seconds}
+            if memory:
+                case["peak_kb"] = peak_memory(text) / 1024
+
+            results["cases"][f"{name}/{n}"] = case
+            times[n] = seconds
+
+        results["scaling"][name] = scaling(times)
+
+    results["cases"].update(load_benchmarks(sizes, repeats, memory))
+    results["cases"].update(micro_benchmarks())
+    return results
+
+
+def compare(results:dict, baseline:dict, tolerance=TOLERANCE):
+    """Returns a list of messages for the cases that got slower or hungrier than the baseline allows."""
+    regressions = []
+
+    for case in results["cases"]:
+        if case not in baseline["cases"]:
+            continue
+        for measure in "seconds", "peak_kb":
+            new, old = results["cases"][case].get(measure), baseline["cases"][case].get(measure)
+            if new != None and old and new > old * (1 + tolerance):
+                regressions += [f"{case}: {measure} {old:.4g} -> {new:.4g} ({new/old:.2f}x)"]
+
+    return regressions
+
+
+def report(results:dict, baseline=None):
+    """Format the results as a table, with the change against a baseline where there is one."""
+    rows = [f"{'case':<16}{'seconds':>12}{'eqns/s':>12}{'peak kB':>12}{'vs base':>10}"]
+
+    for case, r in results["cases"].items():
+        old = baseline["cases"].get(case) if baseline != None else None
+        change = f"{r['seconds'] / old['seconds']:.2f}x" if old else ""
+        eqns_per_s = f"{r['eqns_per_s']:.0f}" if "eqns_per_s" in r else ""
+        peak_kb = f"{r['peak_kb']:.0f}" if "peak_kb" in r else ""
+        rows += [f"{case:<16}{r['seconds']:>12.4g}{eqns_per_s:>12}{peak_kb:>12}{change:>10}"]
+
+    rows += ["", "scaling (time ~ N^k):"]
+    rows += [f"    {name:<12} k = {k:.2f}" for name, k in results["scaling"].items() if k != None]
+    return "\n".join(rows)
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="frees_bench", description="Measure the performance of FreES.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="check the cold import time of the solver against its budget")
+    import_parser.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="seconds allowed for the import")
+
+    run_parser = commands.add_parser("run", help="time and measure solves of the synthetic models")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of equation groups per model")
+    run_parser.add_argument("--cases", nargs="+", default=list(corpus), choices=list(corpus), help="models to run")
+    run_parser.add_argument("--repeats", type=int, default=3, help="solves per case; the best time is kept")
+    run_parser.add_argument("--no-memory", action="store_true", help="skip the (slow) tracemalloc pass")
+    run_parser.add_argument("--save", default=None, help="write the results to a baseline file")
+    run_parser.add_argument("--compare", default=None, help="baseline file to compare against")
+    run_parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed growth over the baseline, e.g. 0.5 for 50%%")
+
+    corpus_parser = commands.add_parser("corpus", help="write the synthetic models to .fr files")
+    corpus_parser.add_argument("folder", help="folder to write to")
+    corpus_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of equation groups per model")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        seconds = import_time()
+        print(f"import frees_lib2: {1000*seconds:.1f} ms (budget {1000*args.budget:.0f} ms)")
+        return 0 if seconds <= args.budget else 1
+
+    elif args.command == "corpus":
+        files = write_corpus(args.folder, args.sizes)
+        print(f"wrote {len(files)} files to {args.folder}")
+        return 0
+
+    elif args.command == "run":
+        baseline = None
+        if args.compare != None:
+            with open(args.compare, "r") as f:
+                baseline = load(f)
+
+        results = run_benchmarks(args.sizes, {name: corpus[name] for name in args.cases}, args.repeats, not args.no_memory)
+        print(report(results, baseline))
+
+        if args.save != None:
+            with open(args.save, "w") as f:
+                dump(results, f, indent=4)
+
+        if baseline != None:
+            regressions = compare(results, baseline, args.tolerance)
+            for line in regressions:
+                print(f"REGRESSION: {line}")
+            return 1 if len(regressions) > 0 else 0
+
+        return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,199 @@
+# FreES headless command line runner.
+# Solves .fr files without the GUI, e.g.:
+#
+#     python -m frees_cli solve models/*.fr --json --jobs 8
+#     python -m frees_cli sweep model.fr --axis x 0 1 101 --axis y 0 2 51 --vars z --out map --plot contour
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from itertools import repeat
+from json import dumps, load
+from logging import basicConfig
+from os import path
+from sys import exit, stdout
+from frees_lib2 import frees, disk_cache, default_cache_dir, f_range, grid_sweep, plot_grid, SWEEP_CHUNK
+
+
+def default_accuracy():
+    """Returns the solver accuracy from settings.json, if there is one next to this file."""
+    fp = path.join(path.dirname(path.abspath(__file__)), "settings.json")
+
+    if path.exists(fp):
+        with open(fp, "r") as f:
+            return float(load(f)["ACCURACY"])
+
+    return 1E-320
+
+
+def find_files(patterns:list):
+    """Expand any wildcards the shell didn't (e.g. on Windows) and return the matching files in order."""
+    files = []
+
+    for pattern in patterns:
+        matches = sorted(glob(pattern)) if any(c in pattern for c in "*?[") else [pattern]
+        files += [fp for fp in matches if fp not in files]
+
+    return files
+
+
+_disk_caches = {} # cache folder -> disk_cache, one per process so its size is only counted once
+
+
+def open_cache(cache_dir:str):
+    """The disk cache in 'cache_dir', shared by every file this process solves."""
+    if cache_dir not in _disk_caches:
+        _disk_caches[cache_dir] = disk_cache(cache_dir)
+    return _disk_caches[cache_dir]
+
+
+def solve_file(fp:str, accuracy:float, profile=False, cache_dir=None, samples=0, seed=None):
+    """Solve one .fr file. Returns a plain dict so that it can be sent back from a worker process.
+    With 'profile', the per-equation statistics of the solve are included too. Solutions are looked 
+    up in and saved to the disk cache in 'cache_dir', if one is given. Files with a '!minimize' or '!maximize' 
+    flag are solved at their optimum. With 'samples', the '!dist' distributions of the inputs are propagated 
+    through the solution and summarized."""
+    result = {"file": fp, "soln": {}, "warnings": [], "error": None}
+
+    try:
+        system = frees.from_file(fp, accuracy, disk_cache=None if cache_dir == None else open_cache(cache_dir))
+        system.solve()
+
+        result.update({
+            "soln": system.soln.soln,
+            "warnings": system.warnings,
+            "duration": system.soln.duration,
+            "percent_err": system.soln.percent_err,
+            "iterations": system.soln.iterations,
+            "evaluations": system.soln.evaluations,
+            "cached": system.soln.cached
+        })
+
+        optimum = system.optimize()
+        if optimum != None:
+            result.update({"soln": optimum.soln, "warnings": system.warnings, "optimum": {"converged": optimum.converged, "iterations": optimum.iterations, "evaluations": optimum.evaluations}})
+
+        if profile:
+            result.update({"passes": system.passes, "stats": system.stats})
+
+        if samples > 0:
+            result["uncertainty"] = system.uncertainty(samples, seed)
+
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    return result
+
+
+def report(result:dict, as_json:bool):
+    """Format one file's result as a line of JSON or as readable text."""
+    if as_json:
+        return dumps(result)
+
+    if result["error"] != None:
+        return f"{result['file']}\n    ERROR: {result['error']}\n"
+
+    values = [f"    {var} = {result['soln'][var]}" for var in result["soln"]]
+    warnings = [f"    WARNING: {' '.join(warning.split())}" for warning in result["warnings"]]
+    spread = [f"    {var} ~ {s['mean']:.6g} +- {s['std']:.4g}  ({', '.join([f'{p} {value:.6g}' for p, value in s['percentiles'].items()])})" 
+              for var, s in result.get("uncertainty", {}).items() if s["mean"] != None and s["std"] > 0]
+    optimum = [f"    (optimum found in {result['optimum']['evaluations']} solves{'' if result['optimum']['converged'] else ', NOT converged'})"] if "optimum" in result else []
+    return "\n".join([result["file"]] + values + optimum + spread + warnings) + "\n"
+
+
+def solve(files:list, accuracy:float, jobs=1, as_json=False, out=stdout, profile=False, cache_dir=None, samples=0, seed=None):
+    """Solve many files, spread over 'jobs' processes, writing each result as soon as it's ready (in file order).
+    Returns the number of files that could not be solved."""
+    failures = 0
+
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        results = pool.map(solve_file, files, repeat(accuracy), repeat(profile), repeat(cache_dir), repeat(samples), repeat(seed), chunksize=max(1, len(files)//(4*jobs)))
+    else:
+        pool = None
+        results = map(solve_file, files, repeat(accuracy), repeat(profile), repeat(cache_dir), repeat(samples), repeat(seed))
+
+    try:
+        for result in results:
+            failures += result["error"] != None
+            out.write(report(result, as_json) + "\n")
+            out.flush()
+    finally:
+        if pool != None:
+            pool.shutdown()
+
+    return failures
+
+
+def sweep_file(fp:str, accuracy:float, axes:dict, dep_vars:list, folder:str, chunk:int, plot=None, out=stdout):
+    """Map 'dep_vars' over the grid of 'axes' for one .fr file, saving the results in 'folder' (and resuming there 
+    if the sweep was interrupted). With 'plot' ("contour" or "heatmap"), each variable is also plotted over the 
+    first two axes, saved as a .png next to its results."""
+    with open(fp, "r") as f:
+        exprs = f.read()
+
+    def progress(done, total):
+        out.write(f"\r{done}/{total} points")
+        out.flush()
+
+    results = grid_sweep(exprs, axes, dep_vars, folder, accuracy, chunk, progress)
+    out.write("\n")
+
+    for var in dep_vars:
+        found = int((results[var] == results[var]).sum()) # nan != nan
+        out.write(f"    {var}: {found} of {results[var].size} points found -> {path.join(folder, var + '.npy')}\n")
+
+        if plot != None and len(axes) > 1:
+            plot_grid(results, list(axes), var, plot, title=f"{var} ({path.basename(fp)})", fp=path.join(folder, f"{var}_{plot}.png"))
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="frees", description="Solve FreES systems without the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    solve_parser = commands.add_parser("solve", help="solve one or more .fr files")
+    solve_parser.add_argument("files", nargs="+", help=".fr files or wildcard patterns")
+    solve_parser.add_argument("--json", action="store_true", help="write one JSON object per file")
+    solve_parser.add_argument("--jobs", "-j", type=int, default=1, help="number of worker processes")
+    solve_parser.add_argument("--accuracy", type=float, default=None, help="solver accuracy (default: from settings.json)")
+    solve_parser.add_argument("--output", "-o", default=None, help="write results to a file instead of stdout")
+    solve_parser.add_argument("--profile", action="store_true", help="include per-equation timings and solver counts in JSON output")
+    solve_parser.add_argument("--cache", default=default_cache_dir(), help="folder of saved solutions to reuse (default: %(default)s)")
+    solve_parser.add_argument("--no-cache", action="store_true", help="always solve, without reading or writing saved solutions")
+    solve_parser.add_argument("--samples", type=int, default=0, help="propagate the '!dist' distributions of the inputs with this many random draws")
+    solve_parser.add_argument("--seed", type=int, default=None, help="random seed for --samples, for repeatable results")
+    solve_parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="solver messages to show on stderr")
+
+    sweep_parser = commands.add_parser("sweep", help="solve one .fr file over a grid of inputs, saving the results as .npy files")
+    sweep_parser.add_argument("file", help=".fr file")
+    sweep_parser.add_argument("--axis", nargs=4, action="append", required=True, metavar=("VAR", "START", "STOP", "POINTS"), help="an independent variable and its range; repeat for more dimensions")
+    sweep_parser.add_argument("--vars", nargs="+", required=True, help="dependent variables to save")
+    sweep_parser.add_argument("--out", required=True, help="folder for the results; an interrupted sweep into the same folder is resumed")
+    sweep_parser.add_argument("--chunk", type=int, default=SWEEP_CHUNK, help="points solved and saved at a time")
+    sweep_parser.add_argument("--plot", default=None, choices=["contour", "heatmap"], help="also plot each variable over the first two axes")
+    sweep_parser.add_argument("--accuracy", type=float, default=None, help="solver accuracy (default: from settings.json)")
+    sweep_parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="solver messages to show on stderr")
+
+    args = parser.parse_args(argv)
+    basicConfig(level=args.log_level, format="%(levelname)s: %(message)s")
+    accuracy = default_accuracy() if args.accuracy == None else args.accuracy
+
+    if args.command == "sweep":
+        axes = {var: f_range(float(start), float(stop), int(points)) for var, start, stop, points in args.axis}
+        sweep_file(args.file, accuracy, axes, args.vars, args.out, args.chunk, args.plot)
+        return 0
+
+    files = find_files(args.files)
+    cache_dir = None if args.no_cache else args.cache
+
+    if args.output != None:
+        with open(args.output, "w") as out:
+            failures = solve(files, accuracy, args.jobs, args.json, out, args.profile, cache_dir, args.samples, args.seed)
+    else:
+        failures = solve(files, accuracy, args.jobs, args.json, profile=args.profile, cache_dir=cache_dir, samples=args.samples, seed=args.seed)
+
+    return 1 if failures > 0 else 0
+
+
+if __name__ == "__main__":
+    exit(main())
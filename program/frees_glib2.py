@@ -1,13 +1,15 @@
 # FreES GUI toolkit library. Version 2
 
 from time import sleep
-from frees_lib2 import frees, f_range
+from frees_lib2 import frees, f_range, sweep, grid_sweep, plot_grid, solve_cache, disk_cache
 from json import load, dump
-from matplotlib import pyplot as plt
+from logging import basicConfig, INFO
 from os import system as sh
 from tkinter import * 
-from tkinter.filedialog import askopenfilename
+from tkinter.filedialog import askopenfilename, asksaveasfilename
 from tkinter.scrolledtext import ScrolledText
+from queue import Queue
+from threading import Thread, Event # after tkinter's * import, which has its own Event
 # from tkinter.ttk import Button, Label, Entry
 
 
@@ -19,6 +21,11 @@ class frees_app:
         self.window.title("FreES - The Free, Open Source, Engineering Equation Solver")
         self.window.minsize(600, 400)
         self.current_file = fp
+        self.cache = solve_cache() # results of earlier solves, so re-solving after an edit is quick
+        try:
+            self.disk_cache = disk_cache() # solutions saved between sessions, for files that haven't changed
+        except OSError:
+            self.disk_cache = None
         Grid.rowconfigure(self.window, 1, weight=1)
         Grid.columnconfigure(self.window, 0, weight=1)
 
@@ -223,7 +230,7 @@ class settings_window:
 
 
 class solution_window:
-    """Window for displaying solution."""
+    """Window for displaying solution. The system is solved on a worker thread so the editor stays responsive."""
 
     def __init__(self, parent:frees_app):
         self.window = Toplevel()
@@ -234,47 +241,112 @@ class solution_window:
 
         with open("settings.json","r") as f:
             settings = load(f)
-            dec_places = settings["DEC_PLACES"]
-            soln_cols = settings["SOLN_COLS"]
+            self.dec_places = settings["DEC_PLACES"]
+            self.soln_cols = settings["SOLN_COLS"]
             accuracy = float(settings["ACCURACY"])
 
-        soln = frees(self.parent.fetch_eqns(), accuracy)
-        try:
-            soln.solve()
+        self.titlebar = Label(self.window, text = "Solution:\n=========")
+        self.swtext = Label(self.window, text = "Solving...")
+        self.cancel_button = Button(self.window, text = "Cancel", command = self.cancel)
+        self.profile_button = Button(self.window, text = "Profile", command = self.open_profile_window, state = "disabled")
+        self.close_button = Button(self.window, text = "Close", command = self.close)
 
-            duration = f"Solved in {round(soln.soln.duration, 5)} seconds."
-            values = [f"{item} = {round(soln.soln.soln[item], dec_places)}" for item in soln.soln.soln]
-            if len(soln.warnings) > 0:
-                warnings = "=========\n" + '\n'.join(soln.warnings)
-            else:
-                warnings = ""
+        self.titlebar       .grid(column = 0, row = 0)
+        self.swtext         .grid(column = 0, row = 1, padx = 10, pady = 10)
+        self.cancel_button  .grid(column = 0, row = 2, pady = 10)
+        self.profile_button .grid(column = 0, row = 3, pady = 10)
+        self.close_button   .grid(column = 0, row = 4, pady = 10)
+
+        eqns = self.parent.fetch_eqns()
+        self.pb = prog_bar(1, style="basic")
+
+        def solve(progress, cancel):
+            soln = frees(eqns, accuracy, cache=self.parent.cache, disk_cache=self.parent.disk_cache)
+            soln.solve(progress=progress, cancel=cancel)
+            if not soln.cancelled:
+                soln.optimize() # only does anything for files with a '!minimize' or '!maximize' line
+            return soln
+
+        self.task = worker(self.window, solve, self.show_progress, self.show_solution)
+
+
+    def show_progress(self, done, total):
+        self.pb.max_prog = max(total, 1)
+        self.pb.increment(done - self.pb.progress)
+        self.swtext.configure(text = self.pb.show())
+
+
+    def show_solution(self, soln, error):
+        self.cancel_button.configure(state = "disabled")
+
+        if error != None:
+            self.swtext.configure(text = f"Could not solve due to the following Python error: \n\n{str(error)}")
+            return
 
-                
-            def sublists(items:list, n:int):
-                # looping till length l
-                for i in range(0, len(items), n): 
-                    yield items[i:i + n]
+        self.soln = soln
+        self.profile_button.configure(state = "normal")
+
+        duration = f"Solved in {round(soln.soln.duration, 5)} seconds."
+        if soln.cancelled:
+            duration = f"Cancelled after {round(soln.soln.duration, 5)} seconds. Partial solution:"
+        elif soln.optimum != None:
+            duration = f"Optimized in {round(soln.optimum.duration, 5)} seconds ({soln.optimum.evaluations} solves)."
+
+        values = [f"{item} = {round(soln.soln.soln[item], self.dec_places)}" for item in soln.soln.soln]
+        if len(soln.warnings) > 0:
+            warnings = "=========\n" + '\n'.join(soln.warnings)
+        else:
+            warnings = ""
 
-            gridified = "\n\n".join(["\t\t".join(i) for i in list(sublists(values, soln_cols))])
             
-            soln_text = f"{duration}\n=========\n\n{gridified}\n\n{warnings}"
+        def sublists(items:list, n:int):
+            # looping till length l
+            for i in range(0, len(items), n): 
+                yield items[i:i + n]
+
+        gridified = "\n\n".join(["\t\t".join(i) for i in list(sublists(values, self.soln_cols))])
         
-        except Exception as e:
-            soln_text = f"Could not solve due to the following Python error: \n\n{str(e)}" 
+        self.swtext.configure(text = f"{duration}\n=========\n\n{gridified}\n\n{warnings}")
 
-        self.titlebar = Label(self.window, text = "Solution:\n=========")
-        self.swtext = Label(self.window, text = soln_text)
-        self.close_button = Button(self.window, text = "Close", command = self.close)
 
-        self.titlebar       .grid(column = 0, row = 0)
-        self.swtext         .grid(column = 0, row = 1, padx = 10, pady = 10)
-        self.close_button   .grid(column = 0, row = 2, pady = 10)
+    def open_profile_window(self):
+        profile_window(self.soln)
+
+
+    def cancel(self):
+        self.task.cancel.set()
 
 
     def close(self):
+        self.task.cancel.set()
         self.window.destroy()
 
 
+
+class profile_window:
+    """Window listing how long each equation took to solve, slowest first."""
+
+    def __init__(self, soln:frees):
+        self.window = Toplevel()
+        self.soln = soln
+        self.window.title("FreES - Profile")
+
+        self.text = ScrolledText(self.window, width = 110, height = 25, font = ("Courier", 10))
+        self.export_button = Button(self.window, text = "Export...", command = self.export)
+
+        self.text           .grid(column = 0, row = 0, padx = 10, pady = 10)
+        self.export_button  .grid(column = 0, row = 1, pady = 10)
+
+        self.text.insert(END, soln.report_stats())
+        self.text.configure(state = "disabled")
+
+
+    def export(self):
+        fp = asksaveasfilename(defaultextension = ".csv", filetypes = [("CSV", "*.csv"), ("JSON", "*.json")])
+        if fp:
+            self.soln.export_stats(fp)
+
+
 class plot_window:
     """Separate Tkinter window for plot generation."""
 
@@ -293,6 +365,7 @@ class plot_window:
         ind_var =   StringVar()
         dep_var =   StringVar()
         ptitle =    StringVar()
+        self.kind = StringVar(self.window, value = "contour")
 
         # Object initialization
         self.dstart_label = Label(plot_menu, text = "Start of Domain")
@@ -301,6 +374,7 @@ class plot_window:
         self.iv_label =     Label(plot_menu, text = "Independent Var.")
         self.dv_label =     Label(plot_menu, text = "Dependent Var.")
         self.t_label =      Label(plot_menu, text = "Plot Title")
+        self.k_label =      Label(plot_menu, text = "2-D Plot")
 
         self.dmn_start =    Entry(plot_menu, width = 30, textvariable = dmn_start)
         self.dmn_end =      Entry(plot_menu, width = 30, textvariable = dmn_end)
@@ -308,8 +382,11 @@ class plot_window:
         self.ind_var =      Entry(plot_menu, width = 30, textvariable = ind_var)
         self.dep_var =      Entry(plot_menu, width = 30, textvariable = dep_var)
         self.title =        Entry(plot_menu, width = 30, textvariable = ptitle)
+        self.kind_menu =    OptionMenu(plot_menu, self.kind, "contour", "heatmap")
 
         self.plot_button = Button(plot_menu, text = "Create Plot", command = self.plot)
+        self.cancel_button = Button(plot_menu, text = "Cancel", command = self.cancel, state = "disabled")
+        self.task = None
 
         # Grid spacing
         self.dstart_label   .grid(column = 0, row = 0, sticky="nsew")
@@ -318,6 +395,7 @@ class plot_window:
         self.iv_label       .grid(column = 2, row = 0, sticky="nsew")
         self.dv_label       .grid(column = 2, row = 1, sticky="nsew")
         self.t_label        .grid(column = 2, row = 2, sticky="nsew")
+        self.k_label        .grid(column = 2, row = 3, sticky="nsew")
 
         self.dmn_start      .grid(column = 1, row = 0, sticky="nsew")
         self.dmn_end        .grid(column = 1, row = 1, sticky="nsew")
@@ -325,43 +403,113 @@ class plot_window:
         self.ind_var        .grid(column = 3, row = 0, sticky="nsew")
         self.dep_var        .grid(column = 3, row = 1, sticky="nsew")
         self.title          .grid(column = 3, row = 2, sticky="nsew")
+        self.kind_menu      .grid(column = 3, row = 3, sticky="nsew")
 
-        self.plot_button.grid(columnspan = 4, row = 3, sticky="nsew")
+        self.plot_button.grid(columnspan = 4, row = 4, sticky="nsew")
+        self.cancel_button.grid(columnspan = 4, row = 5, sticky="nsew")
 
 
     def plot(self):
-        """Plots a given dependent variable as a function of a given dependent variable"""
+        """Plots a given dependent variable as a function of a given dependent variable. 
+        Two independent variables (and their domains) separated by commas give a contour or heatmap plot instead."""
         
-        dmn_size = self.dmn_size.get()
-
-        if dmn_size == "":
-            dmn_size = 25
-        else: 
-            dmn_size = int(dmn_size)
-
-        domain = f_range(
-            float(self.dmn_start.get()), 
-            float(self.dmn_end.get()), 
-            dmn_size
-            )
-        y = []
-        pb = prog_bar(dmn_size, style="basic")
-
-        self.plot_button.configure(text=pb.show())
-        for x in domain:
-            eqns = self.parent.fetch_eqns()
-            system = frees(eqns.replace(self.ind_var.get(), str(x)))
-            system.solve()
-            y.append(system.soln.soln[self.dep_var.get()])
-            
-            pb.increment()
+        ind_vars = [var.strip() for var in self.ind_var.get().split(",")]
+        starts = [float(x) for x in self.dmn_start.get().split(",")]
+        ends = [float(x) for x in self.dmn_end.get().split(",")]
+        sizes = [int(n) for n in self.dmn_size.get().split(",") if n.strip() != ""] or [25]
+        if len(sizes) < len(ind_vars):
+            sizes = sizes[:1] * len(ind_vars)
+
+        domains = {var: f_range(start, end, n) for var, start, end, n in zip(ind_vars, starts, ends, sizes)}
+        points = 1
+        for var in domains:
+            points *= len(domains[var])
+
+        pb = prog_bar(points, style="basic")
+        eqns, ind_var, dep_var, title, kind = self.parent.fetch_eqns(), ind_vars[0], self.dep_var.get(), self.title.get(), self.kind.get()
+
+        def solve(progress, cancel):
+            if len(domains) > 1:
+                return grid_sweep(eqns, domains, [dep_var], progress=progress, cancel=cancel)
+            return sweep(eqns, ind_var, domains[ind_var], [dep_var], progress=progress, cancel=cancel, disk_cache=self.parent.disk_cache)
+
+        def show_progress(done, total):
+            pb.increment(done - pb.progress)
             self.plot_button.configure(text = pb.show())
-            self.plot_button.update_idletasks()
 
-        self.plot_button.configure(text="Create Plot")
-        plt.plot(domain, y)
-        plt.title(self.title.get())
-        plt.show()
+        def show_plot(results, error):
+            self.plot_button.configure(text="Create Plot", state = "normal")
+            self.cancel_button.configure(state = "disabled")
+
+            if error != None:
+                self.plot_button.configure(text = f"Could not plot: {error}")
+                return
+
+            if len(domains) > 1:
+                plot_grid(results, list(domains), dep_var, kind, title)
+                return
+
+            from matplotlib import pyplot as plt # loaded on first plot so the editor opens quickly
+            plt.plot(results[ind_var], results[dep_var])
+            plt.title(title)
+            plt.show()
+
+        self.plot_button.configure(text=pb.show(), state = "disabled")
+        self.cancel_button.configure(state = "normal")
+        self.task = worker(self.window, solve, show_progress, show_plot)
+
+
+    def cancel(self):
+        """Stop the current sweep and plot the points solved so far."""
+        if self.task != None:
+            self.task.cancel.set()
+
+
+class worker:
+    """Runs a task on a background thread. Progress and the result are passed back to the Tk thread through a queue,
+    since Tk widgets may only be touched from the thread running the mainloop."""
+
+    def __init__(self, window, task, on_progress, on_done, poll_ms=50):
+        self.window = window
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.poll_ms = poll_ms
+        self.queue = Queue()
+        self.cancel = Event()
+
+        Thread(target = self.run, args = (task,), daemon = True).start()
+        self.window.after(self.poll_ms, self.poll)
+
+
+    def run(self, task):
+        """Calls task(progress, cancel) on the worker thread."""
+        try:
+            result = task(lambda done, total: self.queue.put(("progress", (done, total))), self.cancel)
+            self.queue.put(("done", (result, None)))
+        except Exception as e:
+            self.queue.put(("done", (None, e)))
+
+
+    def poll(self):
+        """Hand everything the worker has sent so far to the GUI, then check again shortly."""
+        progress = None
+
+        while not self.queue.empty():
+            kind, args = self.queue.get_nowait()
+
+            if kind == "progress":
+                progress = args # only the latest progress is worth drawing
+            else:
+                if progress != None:
+                    self.on_progress(*progress)
+                self.on_done(*args)
+                return
+
+        if progress != None:
+            self.on_progress(*progress)
+
+        if self.window.winfo_exists():
+            self.window.after(self.poll_ms, self.poll)
 
 
 class prog_bar:
@@ -400,4 +548,6 @@ class prog_bar:
         return state
         
 
-frees_app("../tmp").start()
+if __name__ == "__main__":
+    basicConfig(level=INFO, format="%(message)s") # solver messages go to the console, as the prints used to
+    frees_app("../tmp").start()
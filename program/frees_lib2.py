@@ -6,20 +6,43 @@
 # declarative programming even at the cost of 
 # performance drops.
 
+# numpy is slow to import, so it is only imported
+# inside the functions that work with arrays.
 
-from re import findall, IGNORECASE
-from time import time
-from json import load
-from math import sin, cos, tan, sinh, cosh, tanh, asin, acos, atan, log10, log, exp, pi
+
+from re import compile as compile_re, VERBOSE
+from keyword import iskeyword
+from sys import intern
+from time import time, perf_counter
+from logging import getLogger, NullHandler, DEBUG
+from csv import DictWriter
+from heapq import heappop, heappush
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from json import load, loads, dump, dumps
+from os import stat, path, listdir, makedirs, remove, replace, utime, getpid
+from math import sin, cos, tan, sinh, cosh, tanh, asin, acos, atan, asinh, log10, log as ln, exp, pi, isfinite
+
+
+log = getLogger("frees") # silent unless the application sets up logging
+log.addHandler(NullHandler())
 
 
 class soln:
     """Wrapper for solution info returned by solver function."""
-    def __init__(self, soln, duration, percent_err=None, key_var=False):
+    def __init__(self, soln, duration, percent_err=None, key_var=False, converged=True, iterations=0, evaluations=0, bracket=None, residual=None, cached=False, rank=None):
         self.soln = soln
         self.percent_err = percent_err
         self.duration = duration  
         self.key_var = key_var
+        self.converged = converged
+        self.iterations = iterations
+        self.evaluations = evaluations
+        self.bracket = bracket      # (left, right) bracket the root was found in, if any
+        self.residual = residual
+        self.cached = cached        # True if this came from a solve_cache instead of being solved
+        self.rank = rank            # number of independent equations at the solution of a block
 
 
 def f_range(start, stop, steps=8):
@@ -27,17 +50,199 @@ def f_range(start, stop, steps=8):
     return [start + step_size * i for i in range(steps)]
 
 
-def convert(from_unit:str, to_unit:str):
-    """Return a conversion factor between two units."""
-
-    with open("units.json","r") as f:
-        factors = load(f)
+BASE_DIMENSIONS = ("m", "kg", "s", "K", "kmol", "A", "rad") # units.json measures every category in these
+
+# Dimensions of the units.json categories, as powers of the base units. Any other category is a dimension of its own.
+CATEGORY_DIMENSIONS = {
+    "LENGTH": {"m": 1},
+    "MASS": {"kg": 1},
+    "MOLES": {"kmol": 1},
+    "TIME": {"s": 1},
+    "FREQUENCY": {"s": -1},
+    "TEMPERATURE": {"K": 1},
+    "TEMP. DIFFERENCE": {"K": 1},
+    "VELOCITY": {"m": 1, "s": -1},
+    "AREA": {"m": 2},
+    "VOLUME": {"m": 3},
+    "VOLUMETRIC FLOW": {"m": 3, "s": -1},
+    "FORCE": {"kg": 1, "m": 1, "s": -2},
+    "PRESSURE": {"kg": 1, "m": -1, "s": -2},
+    "ENERGY": {"kg": 1, "m": 2, "s": -2},
+    "POWER": {"kg": 1, "m": 2, "s": -3},
+    "VISCOSITY-DYNAMIC": {"kg": 1, "m": -1, "s": -1},
+    "VISCOSITY-KINEMATIC": {"m": 2, "s": -1},
+    "ANGLES": {"rad": 1},
+    "CHARGE": {"A": 1, "s": 1},
+    "ELECTRICAL CAPACITANCE": {"A": 2, "s": 4, "kg": -1, "m": -2},
+    "DIPOLE MOMENT": {"A": 1, "s": 1, "m": 1},
+    "CURRENT": {"A": 1},
+    "ELECTRICAL RESISTANCE": {"kg": 1, "m": 2, "s": -3, "A": -2},
+    "ELECTROMOTIVE FORCE": {"kg": 1, "m": 2, "s": -3, "A": -1},
+    "INDUCTANCE": {"kg": 1, "m": 2, "s": -2, "A": -2},
+    "NON DIMENSIONAL": {},
+    "MAGNETIC FLUX DENSITY": {"kg": 1, "s": -2, "A": -1},
+    "MAGNETIC FLUX": {"kg": 1, "m": 2, "s": -2, "A": -1},
+    "MAGNETIC FIELD STRENGTH": {"A": 1, "m": -1}
+}
+
+_unit_tokens = compile_re(r"\s*(?:(?P<op>\*\*|[*/^()·])|(?P<name>[^\s*/^()·]+))")
+
+
+class unit_registry:
+    """Index of the units and constants in units.json. Loaded on first use and reloaded only when the file changes."""
+
+    def __init__(self, fp=path.join(path.dirname(path.abspath(__file__)), "units.json")):
+        self.fp = fp
+        self.mtime = None
+        self.digest = None  # hash of the file's contents, for caches of results that depend on it
+        self.units = {}     # unit -> {category: factor}, categories in file order
+        self.constants = {}
+        self.bases = []     # base dimensions, in the order of the exponents of every dimension vector
+        self.dims = {}      # category -> tuple of exponents of the bases
+        self.parsed = {}    # unit string -> its (scale, dimensions) readings, see 'parse'
+        self.factors = {}   # (from unit, to unit) -> conversion factor
+
+
+    def refresh(self):
+        """Reload units.json if it has been modified since it was last read."""
+        mtime = stat(self.fp).st_mtime_ns
+
+        if mtime != self.mtime:
+            from hashlib import sha256
+
+            with open(self.fp, "rb") as f:
+                text = f.read()
+            factors = loads(text)
+            self.digest = sha256(text).hexdigest()
+
+            self.constants = factors.pop("CONSTANTS", {})
+            self.units = {}
+            self.parsed = {}
+            self.factors = {}
+            self.bases = list(BASE_DIMENSIONS) + [cat for cat in factors if cat not in CATEGORY_DIMENSIONS]
+            self.dims = {cat: tuple([CATEGORY_DIMENSIONS.get(cat, {cat: 1}).get(base, 0) for base in self.bases]) for cat in factors}
+
+            for cat in factors:
+                for unit in factors[cat]:
+                    self.units.setdefault(unit, {})[cat] = factors[cat][unit]
+            
+            self.mtime = mtime
+
+        return self
+
+
+    def parse(self, unit:str):
+        """Returns the (scale, dimensions) readings of a unit, where the dimensions are a tuple of the powers of 
+        'bases' and the scale converts to the base units. A unit is a name from units.json or a product of them, 
+        e.g. "kg*m/s^2" or "W/(m^2*K)". A name in several categories (like "ton") has a reading for each, 
+        the last category first. Readings are remembered until units.json changes."""
+        if unit not in self.parsed:
+            if self.mtime == None:
+                self.refresh()
+            self.parsed[unit] = self.readings(unit) if unit in self.units else self.compound(unit)
+
+        return self.parsed[unit]
+
+
+    def readings(self, name:str):
+        """The (scale, dimensions) readings of a single unit name or number."""
+        if name in self.units:
+            return [(self.units[name][cat], self.dims[cat]) for cat in reversed(list(self.units[name]))]
+
+        try:
+            return [(float(name), (0,) * len(self.bases))]
+        except ValueError:
+            raise LookupError(f"'{name}' is not a unit in {self.fp}")
+
+
+    def compound(self, unit:str):
+        """Parse a product of units, with '*' or '·' to multiply, '/' to divide, '^' or '**' for powers and brackets."""
+        tokens = [(match.lastgroup, match.group(match.lastgroup)) for match in _unit_tokens.finditer(unit.strip())]
+        position = 0
+
+        def combine(left, right, sign):
+            result = {}
+            for scale, dims in left:
+                for other_scale, other_dims in right:
+                    key = tuple([a + sign*b for a, b in zip(dims, other_dims)])
+                    result.setdefault(key, scale * other_scale**sign) # keep the first reading of each dimension
+            return [(scale, dims) for dims, scale in result.items()]
+
+        def product():
+            nonlocal position
+            result = power()
+            while position < len(tokens) and tokens[position][1] in ("*", "·", "/"):
+                sign = -1 if tokens[position][1] == "/" else 1
+                position += 1
+                result = combine(result, power(), sign)
+            return result
+
+        def power():
+            nonlocal position
+            result = atom()
+            if position < len(tokens) and tokens[position][1] in ("^", "**"):
+                if position + 1 == len(tokens) or tokens[position + 1][0] != "name":
+                    raise ValueError(f"Expected a power after '{tokens[position][1]}' in '{unit}'")
+                try:
+                    exponent = float(tokens[position + 1][1])
+                except ValueError:
+                    raise ValueError(f"'{tokens[position + 1][1]}' is not a power in '{unit}'")
+                position += 2
+                result = [(scale**exponent, tuple([a*exponent for a in dims])) for scale, dims in result]
+            return result
+
+        def atom():
+            nonlocal position
+            if position == len(tokens):
+                raise ValueError(f"'{unit}' ends too soon")
+            kind, value = tokens[position]
+            position += 1
+            if value == "(":
+                result = product()
+                if position == len(tokens) or tokens[position][1] != ")":
+                    raise ValueError(f"Unbalanced brackets in '{unit}'")
+                position += 1
+                return result
+            elif kind == "name":
+                return self.readings(value)
+            raise ValueError(f"Unexpected '{value}' in '{unit}'")
+
+        result = product()
+        if position != len(tokens):
+            raise ValueError(f"Unexpected '{tokens[position][1]}' in '{unit}'")
+        return result
+
+
+    def describe(self, dims:tuple):
+        """Write a dimension vector in base units, e.g. "kg m s^-2"."""
+        terms = [base if power == 1 else f"{base}^{power:g}" for base, power in zip(self.bases, dims) if power != 0]
+        return " ".join(terms) if len(terms) > 0 else "dimensionless"
+
+
+    def factor(self, from_unit:str, to_unit:str):
+        """Returns the conversion factor between two units (names or products of them) with the same dimensions.
+        Raises LookupError if they have none in common."""
+        key = (from_unit, to_unit)
+
+        if key not in self.factors:
+            readings = self.parse(from_unit)
+            others = self.parse(to_unit)
+            scales = [scale / other_scale for scale, dims in readings for other_scale, other_dims in others if dims == other_dims]
+
+            if len(scales) == 0:
+                raise LookupError(f"Can't convert '{from_unit}' ({self.describe(readings[0][1])}) to '{to_unit}' ({self.describe(others[0][1])})")
+
+            self.factors[key] = scales[0]
+
+        return self.factors[key]
+
+
+registry = unit_registry()
 
-    for cat in factors:
-        if from_unit in factors[cat] and to_unit in factors[cat]:
-            unit_set = factors[cat]
 
-    return unit_set[from_unit]/unit_set[to_unit]
+def convert(from_unit:str, to_unit:str):
+    """Return a conversion factor between two units."""
+    return registry.factor(from_unit, to_unit)
 
 
 def I_tube(OD, ID):
@@ -55,22 +260,150 @@ def I_u_channel(b, h, thk):
     return ((b-2*thk)*thk**3)/3 + 2*(thk*h**3)/3
 
 
+class dual:
+    """A dual number val + der*e with e^2 = 0, for forward-mode automatic differentiation. Evaluating 
+    an expression at dual(x, 1) gives its value at x and its exact derivative there in one pass."""
+    __slots__ = ("val", "der")
+
+    def __init__(self, val:float, der=0.0):
+        self.val = val
+        self.der = der
+
+    def __repr__(self):
+        return f"dual({self.val!r}, {self.der!r})"
+
+    def __add__(self, other):
+        if type(other) is dual:
+            return dual(self.val + other.val, self.der + other.der)
+        return dual(self.val + other, self.der)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if type(other) is dual:
+            return dual(self.val - other.val, self.der - other.der)
+        return dual(self.val - other, self.der)
+
+    def __rsub__(self, other):
+        return dual(other - self.val, -self.der)
+
+    def __mul__(self, other):
+        if type(other) is dual:
+            return dual(self.val * other.val, self.der * other.val + self.val * other.der)
+        return dual(self.val * other, self.der * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if type(other) is dual:
+            return dual(self.val / other.val, (self.der * other.val - self.val * other.der) / other.val**2)
+        return dual(self.val / other, self.der / other)
+
+    def __rtruediv__(self, other):
+        return dual(other / self.val, -other * self.der / self.val**2)
+
+    def __pow__(self, other):
+        if type(other) is dual: # d(u^v) = u^v (v' ln u + v u'/u)
+            value = self.val ** other.val
+            return dual(value, value * (other.der * ln(self.val) + other.val * self.der / self.val))
+        if other == 0:
+            return dual(1.0, 0.0)
+        return dual(self.val ** other, other * self.val ** (other - 1) * self.der)
+
+    def __rpow__(self, other):
+        value = other ** self.val
+        return dual(value, value * ln(other) * self.der if other != 0 else 0.0)
+
+    def __neg__(self):
+        return dual(-self.val, -self.der)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return dual(abs(self.val), self.der if self.val >= 0 else -self.der)
+
+    def __eq__(self, other):
+        return self.val == (other.val if type(other) is dual else other)
+
+    def __lt__(self, other):
+        return self.val < (other.val if type(other) is dual else other)
+
+    def __le__(self, other):
+        return self.val <= (other.val if type(other) is dual else other)
+
+    def __gt__(self, other):
+        return self.val > (other.val if type(other) is dual else other)
+
+    def __ge__(self, other):
+        return self.val >= (other.val if type(other) is dual else other)
+
+    __hash__ = None
+
+
+def lift(f, df):
+    """Returns a version of the math function 'f' that also takes dual numbers, given its derivative 'df'."""
+    def lifted(x):
+        if type(x) is dual:
+            return dual(f(x.val), df(x.val) * x.der)
+        return f(x)
+
+    lifted.__name__ = f.__name__
+    return lifted
+
+
+ad_sin = lift(sin, cos)
+ad_cos = lift(cos, lambda x: -sin(x))
+ad_tan = lift(tan, lambda x: 1 / cos(x)**2)
+ad_sinh = lift(sinh, cosh)
+ad_cosh = lift(cosh, sinh)
+ad_tanh = lift(tanh, lambda x: 1 / cosh(x)**2)
+ad_asin = lift(asin, lambda x: 1 / (1 - x*x)**0.5)
+ad_acos = lift(acos, lambda x: -1 / (1 - x*x)**0.5)
+ad_atan = lift(atan, lambda x: 1 / (1 + x*x))
+ad_log10 = lift(log10, lambda x: 1 / (x * ln(10)))
+ad_ln = lift(ln, lambda x: 1 / x)
+ad_exp = lift(exp, exp)
+
+
+def with_slope(f):
+    """Returns a function of x giving f(x) and f'(x). The derivative is exact, from a single evaluation at a dual 
+    number, unless f turns out not to accept them (e.g. a user function built on math), when a finite difference is used."""
+    uses_duals = True
+
+    def f_and_slope(x:float):
+        nonlocal uses_duals
+        if uses_duals:
+            try:
+                y = f(dual(x, 1.0))
+            except TypeError:
+                uses_duals = False
+            else:
+                return (y.val, y.der) if type(y) is dual else (y, 0.0) # a plain number means f doesn't depend on x (or failed)
+
+        fx = f(x)
+        h = 1.5E-8 * max(abs(x), 1.0)
+        return fx, (f(x + h) - fx) / h
+
+    return f_and_slope
+
+
 def default_function_toolkit():
-    """Returns the default functions to be recognized by FreES."""
+    """Returns the default functions to be recognized by FreES. The math functions also take 'dual' numbers."""
 
     return {
-        "sin":sin,
-        "cos":cos,
-        "tan":tan,
-        "sinh":sinh,
-        "cosh":cosh,
-        "tanh":tanh,
-        "asin":asin,
-        "acos":acos,
-        "atan":atan,
-        "log":log10,
-        "ln":log,
-        "exp":exp,
+        "sin":ad_sin,
+        "cos":ad_cos,
+        "tan":ad_tan,
+        "sinh":ad_sinh,
+        "cosh":ad_cosh,
+        "tanh":ad_tanh,
+        "asin":ad_asin,
+        "acos":ad_acos,
+        "atan":ad_atan,
+        "log":ad_log10,
+        "ln":ad_ln,
+        "exp":ad_exp,
         "convert":convert,
         "iTube":I_tube,
         "iRect":I_rect,
@@ -78,10 +411,29 @@ def default_function_toolkit():
     }
 
 
+def numpy_function_toolkit():
+    """Returns the default functions, with numpy versions where needed so that they work on whole arrays."""
+    import numpy as np
+
+    return uar(default_function_toolkit(), {
+        "sin":np.sin,
+        "cos":np.cos,
+        "tan":np.tan,
+        "sinh":np.sinh,
+        "cosh":np.cosh,
+        "tanh":np.tanh,
+        "asin":np.arcsin,
+        "acos":np.arccos,
+        "atan":np.arctan,
+        "log":np.log10,
+        "ln":np.log,
+        "exp":np.exp
+    })
+
+
 def default_constant_toolkit():
     """Returns a dict of the constants recognized by FreES."""
-    with open("units.json", "r") as f:
-        return load(f)["CONSTANTS"]
+    return registry.refresh().constants
 
 
 def uar(myDict:dict, newDict:dict):
@@ -90,27 +442,759 @@ def uar(myDict:dict, newDict:dict):
         return myDict
 
 
-def iter_solve(func:str, condition:float, var="x", vals={}, left_search_bound=1E20, right_search_bound=-1E20, target_dx=1E-50, steps=8):
-    """A more declarative approach to iterative solving. Approximately 4-5x slower than 'iter_solve', but much easier to understand."""
+EXPR_CACHE_SIZE = 4096 # expressions whose compiled code and polynomial degree are kept; the oldest are dropped first
+
+@lru_cache(maxsize=EXPR_CACHE_SIZE)
+def compile_expr(expr:str, var=None):
+    """Returns a cached code object for an expression. If 'var' is given, the code builds a function of 'var' 
+    (or of each variable in a tuple of them) instead."""
+    args = ", ".join(var) if type(var) == tuple else var
+    src = expr.strip() if var is None else f"lambda {args}: ({expr}\n)"
+    return compile(src, "<frees>", "eval")
+
+
+def evaluate(expr:str, vals:dict):
+    """Evaluates an expression through the compiled equation cache."""
+    return eval(compile_expr(expr), vals)
+
+
+def bind(expr:str, var:str, vals:dict):
+    """Returns an expression as a python function of 'var' with every other name bound to 'vals'."""
+    return eval(compile_expr(expr, var), vals)
+
+
+MAX_DEGREE = 32 # highest power handed to 'poly_solve'; beyond this the companion matrix loses too much precision
+
+def expr_form(expr:str, var:str):
+    """Returns "explicit" if an expression is just 'var', "linear" or "polynomial" if it is built from 'var' 
+    with only +, -, *, / (by things that don't contain 'var') and whole powers, and "nonlinear" otherwise."""
+    degree = expr_degree(expr, var)
+    if degree == -1:
+        return "explicit"
+    elif degree == None or degree > MAX_DEGREE:
+        return "nonlinear"
+    return "linear" if degree <= 1 else "polynomial"
+
+
+@lru_cache(maxsize=EXPR_CACHE_SIZE)
+def expr_degree(expr:str, var:str):
+    """Returns the degree of an expression as a polynomial in 'var', None if it isn't one, or -1 if it is just 'var'."""
+    import ast
+
+    def has_var(node):
+        return any(isinstance(n, ast.Name) and n.id == var for n in ast.walk(node))
+
+    def degree(node):
+        if not has_var(node):
+            return 0
+        elif isinstance(node, ast.Name):
+            return 1
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            return degree(node.operand)
+        elif not isinstance(node, ast.BinOp):
+            return None
+
+        left, right = degree(node.left), degree(node.right)
+        if left == None or right == None:
+            return None
+        elif isinstance(node.op, (ast.Add, ast.Sub)):
+            return max(left, right)
+        elif isinstance(node.op, ast.Mult):
+            return left + right
+        elif isinstance(node.op, ast.Div) and right == 0:
+            return left
+        elif isinstance(node.op, ast.Pow) and right == 0 and isinstance(node.right, ast.Constant):
+            power = node.right.value
+            if type(power) in (int, float) and power >= 0 and float(power).is_integer():
+                return left * int(power)
+        return None
 
+    try:
+        tree = ast.parse(expr.strip(), mode="eval").body
+        return -1 if isinstance(tree, ast.Name) and tree.id == var else degree(tree)
+    except SyntaxError:
+        return None # let the root finders report it
+
+
+def direct_solve(func:str, condition:float, var="x", vals={}, left_search_bound=-1E20, right_search_bound=1E20):
+    """Solve func(var) = condition without iterating, when 'func' is just 'var' or is linear in it ('expr_form').
+    A linear function is evaluated at 0 and 1 and solved in closed form, then corrected once with the same slope.
+    Returns None if that isn't possible or lands outside the bounds, so the caller can iterate instead."""
     start = time()
+    form = expr_form(func, var)
+
+    if form == "explicit":
+        x, evaluations = condition, 0
+
+    elif form == "linear":
+        f = bind(func, var, vals)
+        try:
+            f0 = f(0.0) - condition
+            slope = f(1.0) - condition - f0
+            x = -f0 / slope
+            x -= (f(x) - condition) / slope
+        except (OverflowError, ZeroDivisionError, ValueError, TypeError):
+            return None
+        evaluations = 4 # including the check below
 
-    def f(x): return eval(func, uar(vals, {var: x}))
-    def e(x): return abs(f(x) - condition)
+    else:
+        return None
 
-    x = left_search_bound
-    dx = abs((left_search_bound - right_search_bound) / steps)
-    
-    while abs(dx) > target_dx:
+    left_search_bound, right_search_bound = sorted((left_search_bound, right_search_bound))
+    if type(x) not in (int, float) or not isfinite(x) or not left_search_bound <= x <= right_search_bound:
+        return None
+
+    value = x if form == "explicit" else bind(func, var, vals)(x)
+    return soln({var: float(x)}, time()-start, percent_err=percent_error(value, condition), iterations=0, evaluations=evaluations, residual=value - condition)
+
+
+EPS = 2.220446049250313E-16 # spacing of floats near 1.0
+
+
+def percent_error(value:float, target:float):
+    """Percent difference between a value and its target. Falls back to the absolute difference when the target is 0."""
+    return 100*abs(value - target)/abs(target) if target != 0 else 100*abs(value - target)
+
+
+def real_residual(f, x, condition:float):
+    """f(x) - condition, or nan where f can't be evaluated or comes out complex (as a negative number 
+    to a fractional power does)."""
+    try:
+        value = f(x) - condition
+    except (OverflowError, ZeroDivisionError, ValueError):
+        return float("nan")
+    except TypeError: # complex numbers can't be compared, but a function that doesn't take dual numbers must still say so
+        if type(x) is dual:
+            raise
+        return float("nan")
+
+    parts = (value.val, value.der) if type(value) is dual else (value,)
+    return float("nan") if any([type(part) is complex for part in parts]) else value
+
+
+def find_bracket(f, left_search_bound:float, right_search_bound:float, x0=None, step=None, f0=None):
+    """Walk outwards from 'x0' in doubling steps (starting from 'step', if given) until 'f' changes sign. 
+    'f0' is f(x0), if it is already known. Returns (a, b, f(a), f(b), found) where a and b are the bracket, or the best point found and its neighbour."""
+
+    x0 = min(max(0.0 if x0 == None else x0, left_search_bound), right_search_bound)
+    f0 = f(x0) if f0 == None else f0
+    best = (x0, f0, x0, f0)
+    sides = {1: (x0, f0), -1: (x0, f0)} # direction -> last point and value
+
+    if f0 == 0:
+        return x0, x0, f0, f0, True
+
+    step = 1E-2 * max(abs(x0), 1.0) if step == None else step
+    while len(sides) > 0:
+
+        for direction in list(sides):
+            last_x, last_f = sides[direction]
+            x = min(max(x0 + direction*step, left_search_bound), right_search_bound)
+            fx = f(x)
 
-        while e(x + dx) < e(x) and left_search_bound < x + dx < right_search_bound: # Do not ignore search bounds
-            x += dx
+            if x == last_x or not isfinite(fx): # hit a search bound or the edge of the function's domain
+                del sides[direction]
+                continue
+
+            if fx == 0 or (isfinite(last_f) and (fx < 0) != (last_f < 0)): # (no sign to compare if x0 is outside the function's domain)
+                return (last_x, x, last_f, fx, True) if last_x < x else (x, last_x, fx, last_f, True)
+
+            if abs(fx) < abs(best[1]) or not isfinite(best[1]):
+                best = (x, fx, last_x, last_f)
+            sides[direction] = (x, fx)
+
+        step *= 2
+
+    return best[0], best[2], best[1], best[3], False
+
+
+ROOT_SAMPLES = 400 # points 'sample_brackets' checks for sign changes when enumerating roots
+
+
+def sample_brackets(f, left_search_bound:float, right_search_bound:float, samples=ROOT_SAMPLES):
+    """Every sign change of 'f' between points spread evenly in asinh(x) over the bounds, which is even near 0 and 
+    logarithmic far from it, so that a search out to +-1E20 still looks closely at ordinary values. 
+    Returns the brackets (a, b, f(a), f(b)) in increasing order. A point where f is exactly 0 is a bracket of its own."""
+    t0, t1 = asinh(left_search_bound), asinh(right_search_bound)
+    points = [left_search_bound] + [sinh(t0 + (t1 - t0) * i / (samples - 1)) for i in range(1, samples - 1)] + [right_search_bound]
+    values = [f(x) for x in points]
+    brackets = []
+
+    for i, (x, fx) in enumerate(zip(points, values)):
+        last_x, last_f = (points[i - 1], values[i - 1]) if i > 0 else (None, float("nan"))
+        if fx == 0:
+            brackets.append((x, x, fx, fx))
+        elif isfinite(fx) and isfinite(last_f) and last_f != 0 and (fx < 0) != (last_f < 0):
+            brackets.append((last_x, x, last_f, fx))
+        elif 0 < i < len(points) - 1 and isfinite(last_f) and isfinite(values[i + 1]) and (last_f < 0) == (fx < 0) == (values[i + 1] < 0) \
+                and abs(fx) < abs(last_f) and abs(fx) <= abs(values[i + 1]): # (a lowest point, taking the first of a level pair)
+            brackets += dip_brackets(f, (last_x, last_f), (x, fx), (points[i + 1], values[i + 1]))
+
+    return sorted(brackets)
+
+
+def dip_brackets(f, left:tuple, middle:tuple, right:tuple, max_iter=8):
+    """Brackets around a pair of roots close enough together to fit between three samples (x, f(x)) where |f| dips 
+    without changing sign, as near the top of cos(x) = 0.9999995. The vertex of the parabola through the samples 
+    is tried for as long as it predicts a sign change. Returns two brackets, a zero as a bracket of its own, or none."""
+    for i in range(max_iter):
+        (a, fa), (m, fm), (b, fb) = left, middle, right
+        slope_a, slope_b = (fm - fa) / (m - a), (fb - fm) / (b - m)
+        curvature = (slope_b - slope_a) / (b - a)
+        if curvature == 0 or not isfinite(curvature):
+            return []
+
+        # The parabola is fa + slope_a (x - a) + curvature (x - a)(x - m), with its vertex at v
+        v = (a + m) / 2 - slope_a / (2 * curvature)
+        if not a < v < b or v == m:
+            return []
+        predicted = fa + slope_a * (v - a) + curvature * (v - a) * (v - m)
+        if predicted != 0 and (predicted < 0) == (fm < 0): # the parabola doesn't reach zero, so there's nothing to find
+            return []
+
+        fv = f(v)
+        if fv == 0:
+            return [(v, v, fv, fv)]
+        elif not isfinite(fv):
+            return []
+        elif (fv < 0) != (fm < 0):
+            return [(a, v, fa, fv), (v, b, fv, fb)]
+        elif abs(fv) < abs(fm): # closer, so look again around the new lowest point
+            left, middle, right = ((a, fa), (v, fv), (m, fm)) if v < m else ((m, fm), (v, fv), (b, fb))
+        else:
+            left, right = ((v, fv), right) if v < m else (left, (v, fv))
+
+    return []
+
+
+def brent(f, a:float, b:float, fa:float, fb:float, xtol:float, ftol:float, max_iter=200):
+    """Brent's method. Needs a bracket [a, b] around the root."""
+    if fa * fb > 0:
+        return b, 0, False
+
+    c, fc = a, fa
+    d = e = b - a
+
+    for i in range(1, max_iter + 1):
+        if fb * fc > 0:
+            c, fc = a, fa
+            d = e = b - a
+
+        if abs(fc) < abs(fb): # keep b as the best guess
+            a, b, c = b, c, b
+            fa, fb, fc = fb, fc, fb
+
+        tol = 2*EPS*abs(b) + 0.5*xtol
+        m = 0.5*(c - b)
+        if abs(m) <= tol or abs(fb) <= ftol:
+            return b, i, True
+
+        if abs(e) >= tol and abs(fa) > abs(fb): # try interpolating
+            s = fb/fa
+            if a == c:
+                p = 2*m*s
+                q = 1 - s
+            else:
+                q = fa/fc
+                r = fb/fc
+                p = s*(2*m*q*(q - r) - (b - a)*(r - 1))
+                q = (q - 1)*(r - 1)*(s - 1)
+
+            if p > 0:
+                q = -q
+            else:
+                p = -p
+
+            if 2*p < min(3*m*q - abs(tol*q), abs(e*q)):
+                e = d
+                d = p/q
+            else:
+                d = e = m
+
+        else: # bisect
+            d = e = m
+
+        a, fa = b, fb
+        b += d if abs(d) > tol else (tol if m > 0 else -tol)
+        fb = f(b)
+
+    return b, max_iter, False
+
+
+def bisect(f, a:float, b:float, fa:float, fb:float, xtol:float, ftol:float, max_iter=2000):
+    """Bisection. Needs a bracket [a, b] around the root."""
+    if fa * fb > 0:
+        return b, 0, False
+
+    for i in range(1, max_iter + 1):
+        m = 0.5*(a + b)
+        if 0.5*abs(b - a) <= xtol + 2*EPS*abs(m) or m == a or m == b:
+            return m, i, True
+
+        fm = f(m)
+        if abs(fm) <= ftol:
+            return m, i, True
+
+        if (fm < 0) == (fa < 0):
+            a, fa = m, fm
+        else:
+            b, fb = m, fm
+
+    return 0.5*(a + b), max_iter, False
+
+
+def secant(f, a:float, b:float, fa:float, fb:float, xtol:float, ftol:float, max_iter=200):
+    """Secant method. Starts from a and b, which do not need to bracket the root."""
+    for i in range(1, max_iter + 1):
+        if fa == fb:
+            return b, i, abs(fb) <= ftol
+
+        a, fa, b = b, fb, b - fb*(b - a)/(fb - fa)
+        fb = f(b)
+
+        if not isfinite(fb):
+            return b, i, False
+
+        if abs(fb) <= ftol or abs(b - a) <= xtol + 4*EPS*abs(b):
+            return b, i, True
+
+    return b, max_iter, False
+
+
+def newton(f, a:float, b:float, fa:float, fb:float, xtol:float, ftol:float, max_iter=200):
+    """Newton's method with exact derivatives where f takes dual numbers ('with_slope'). Given a bracket, steps 
+    that would leave it or that don't shrink it quickly enough are replaced by bisection, so it always converges. 
+    Without one, it is plain Newton from whichever of a and b is closer to the root."""
+    f_and_slope = with_slope(f)
+
+    if fa == 0 or fb == 0:
+        return (a, 0, True) if fa == 0 else (b, 0, True)
+
+    x = a if abs(fa) < abs(fb) else b
+    fx, dfx = f_and_slope(x)
+    bracketed = a != b and (fa < 0) != (fb < 0)
+    lo, hi = (a, b) if fa < 0 else (b, a) # f(lo) < 0 < f(hi)
+    last_dx = abs(b - a)
+    max_iter = max_iter if bracketed else min(max_iter, 20) # unguarded Newton that hasn't converged by now likely won't
+
+    for i in range(1, max_iter + 1):
+        if not isfinite(fx):
+            return x, i, False
+
+        step = fx/dfx if dfx != 0 and isfinite(dfx) else None
+
+        if step != None and x - step == x: # converged as far as floats can tell
+            return x, i, True
+
+        if bracketed and (step == None or not min(lo, hi) < x - step < max(lo, hi) or abs(2*step) > last_dx):
+            step = x - (lo + hi)/2
+        elif step == None:
+            return x, i, abs(fx) <= ftol
+
+        last_dx = abs(step)
+        x -= step
+        fx, dfx = f_and_slope(x)
+
+        if abs(fx) <= ftol or fx == 0 or abs(step) <= xtol + 4*EPS*abs(x):
+            return x, i, isfinite(fx)
+
+        if bracketed:
+            if fx < 0:
+                lo = x
+            else:
+                hi = x
+            if abs(hi - lo) <= xtol + 4*EPS*abs(x):
+                return x, i, True
+
+    return x, max_iter, False
+
+
+def pattern_search(f, left_search_bound:float, right_search_bound:float, x0:float, xtol:float, ftol:float, steps=8, max_iter=10000):
+    """The original FreES search: walk downhill on |f| in steps that shrink and change direction.
+    Used for roots that never change sign, like those of x^2 = 0."""
+    x, ex = x0, abs(f(x0))
+    dx = max(abs(x0), 1.0)
+    i = 0
+
+    while abs(dx) > xtol + 4*EPS*abs(x) and i < max_iter:
+
+        while left_search_bound <= x + dx <= right_search_bound and i < max_iter: # Do not ignore search bounds
+            e_next = abs(f(x + dx))
+            i += 1
+            if not e_next < ex:
+                break
+            x, ex = x + dx, e_next
 
-        x += dx # go to the next point
         dx *= -2 / steps
 
-    x += dx * steps / -2
-    return soln({var: x}, time()-start, percent_err=100*abs(f(x)-condition)/condition)
+    return x, i, ex <= ftol
+
+
+root_finders = {
+    "brent": brent,
+    "bisect": bisect,
+    "secant": secant,
+    "newton": newton
+}
+
+
+def horner(coeffs:list, x):
+    """Value of a polynomial (coefficients highest power first) at x."""
+    value = 0.0
+    for c in coeffs:
+        value = value * x + c
+    return value
+
+
+_unity = {}
+
+def poly_coeffs(f, n:int, radius=1.0):
+    """Coefficients (highest power first) of a polynomial function of degree below n, found exactly from its 
+    values on a circle of 'radius' (at the n-th roots of unity, scaled) by a discrete Fourier transform. 
+    Leading terms that are negligible everywhere on the circle are dropped."""
+    if n not in _unity:
+        _unity[n] = [complex(cos(2*pi*k/n), sin(2*pi*k/n)) for k in range(n)]
+    w = _unity[n]
+
+    values = [complex(f(radius * z)) for z in w]
+    scaled = [sum([values[k] * w[-j*k % n] for k in range(n)]).real / n for j in range(n)] # c_j * radius^j, lowest power first
+    scale = max([abs(c) for c in scaled])
+
+    while len(scaled) > 0 and abs(scaled[-1]) <= 8 * EPS * n * scale:
+        scaled.pop()
+    return [c / radius**j for j, c in enumerate(scaled)][::-1]
+
+
+def root_radius(coeffs:list):
+    """Fujiwara's bound on the size of the roots of a polynomial (coefficients highest power first)."""
+    return 2 * max([abs(c / coeffs[0]) ** (1 / j) for j, c in enumerate(coeffs) if j > 0] + [0.0])
+
+
+def poly_roots(coeffs:list):
+    """Real roots of a polynomial (coefficients highest power first), each multiple root given once, 
+    as a list of (root, multiplicity)."""
+    degree = len(coeffs) - 1
+
+    if degree == 1:
+        return [(-coeffs[1] / coeffs[0], 1)]
+
+    elif degree == 2: # the quadratic formula, arranged so that neither root suffers cancellation
+        a, b, c = coeffs
+        disc = b*b - 4*a*c
+        if abs(disc) <= 64 * EPS * (b*b + abs(4*a*c)):
+            return [(-b / (2*a), 2)]
+        elif disc < 0:
+            return []
+        q = -(b + (disc**0.5 if b >= 0 else -disc**0.5)) / 2
+        return [(x, 1) for x in sorted([q / a, c / q])] if q != 0 else [(0.0, 1)]
+
+    import numpy as np
+
+    companion = np.diag(np.ones(degree - 1), -1)
+    companion[0, :] = -np.array(coeffs[1:]) / coeffs[0]
+    eigenvalues = np.linalg.eigvals(companion).tolist()
+
+    # A root of multiplicity m comes out as a ring of m eigenvalues around it, of radius about eps^(1/m) times the root, 
+    # but their mean is accurate. From the highest multiplicity down, each eigenvalue and its nearest neighbours are 
+    # taken as one root if they fit in such a ring and their mean is a root to within rounding, so near but distinct 
+    # roots stay apart.
+    magnitudes = [abs(c) for c in coeffs]
+
+    def fits(cluster):
+        mean = sum(cluster) / len(cluster)
+        if not all([abs(z - mean) <= 32 * EPS**(1 / len(cluster)) * max(1.0, abs(mean)) for z in cluster]):
+            return False
+        return abs(horner(coeffs, mean)) <= 64 * (degree + 1) * EPS * horner(magnitudes, abs(mean))
+
+    remaining, clusters = list(eigenvalues), []
+    for m in range(degree, 1, -1):
+        z = 0
+        while z < len(remaining) and len(remaining) >= m:
+            nearest = sorted(remaining, key=lambda w: abs(w - remaining[z]))[:m]
+            if fits(nearest):
+                clusters.append(nearest)
+                for w in nearest:
+                    remaining.remove(w)
+                z = 0
+            else:
+                z += 1
+    clusters += [[z] for z in remaining]
+
+    roots = []
+    for cluster in clusters:
+        mean = sum(cluster) / len(cluster)
+        if abs(mean.imag) <= 1E-6 * max(1.0, abs(mean)):
+            roots.append((mean.real, len(cluster)))
+
+    return sorted(roots)
+
+
+def poly_solve(func:str, condition:float, var="x", vals={}, left_search_bound=-1E20, right_search_bound=1E20, guess=None):
+    """Solve func(var) = condition when 'func' is a polynomial in 'var' ('expr_form'). All of its real roots are 
+    found at once ('poly_real_roots'). Of the roots within the bounds, the one nearest 'guess' (or 0) is returned, 
+    as the root finders would find. Returns None if there isn't one."""
+    start = time()
+    left_search_bound, right_search_bound = sorted((left_search_bound, right_search_bound))
+    x0 = min(max(0.0 if guess == None else guess, left_search_bound), right_search_bound)
+
+    found = poly_real_roots(bind(func, var, vals), condition, expr_degree(func, var))
+    if found == None:
+        return None
+
+    roots, iterations, evaluations = found
+    candidates = [(x, fx) for x, fx in roots if left_search_bound <= x <= right_search_bound]
+    if len(candidates) == 0:
+        return None
+
+    x, fx = min(candidates, key=lambda c: abs(c[0] - x0))
+    return soln({var: x}, time()-start, percent_err=percent_error(fx + condition, condition), iterations=iterations, evaluations=evaluations, residual=fx)
+
+
+def poly_real_roots(f, condition:float, degree:int):
+    """Every real root of f(x) = condition for a polynomial 'f' of at most 'degree', from the eigenvalues of its 
+    companion matrix (above degree 2), each polished with Newton steps. Returns ([(root, residual)] in 
+    increasing order, iterations, evaluations), or None if the coefficients can't be found."""
+    n = degree + 1
+    radius, evaluations = 1.0, 0
+
+    # Terms too small to see on the unit circle can still be the largest near roots far from it, so the 
+    # coefficients are found again on a circle big enough to hold all of the roots of those found so far
+    for attempt in range(8):
+        try:
+            coeffs = poly_coeffs(lambda z: f(z) - condition, n, radius)
+        except (OverflowError, ZeroDivisionError, ValueError, TypeError):
+            return None
+        evaluations += n
+
+        if len(coeffs) < 2 or not all([isfinite(c) for c in coeffs]):
+            return None
+
+        # The coefficients are only good to rounding of the largest term on the circle, so a leading term that 
+        # is small there (against the roots' size) is found again on a bigger circle, as are any that were dropped
+        bound = root_radius(coeffs)
+        if bound <= 4 * radius or len(coeffs) == n and (bound / (2 * radius))**(n - 1) <= 1E8:
+            break
+        radius = bound
+
+    slope = [c * (len(coeffs) - 1 - i) for i, c in enumerate(coeffs[:-1])]
+    magnitudes = [abs(c) for c in coeffs]
+    iterations = 0
+    roots = []
+
+    for x, multiplicity in poly_roots(coeffs):
+        fx = f(x) - condition
+        evaluations += 1
+
+        for i in range(3):
+            d = horner(slope, x)
+            if d == 0 or fx == 0:
+                break
+            x_new = x - multiplicity * fx / d # (the step that converges quickly to a multiple root)
+            f_new = f(x_new) - condition
+            evaluations += 1
+            iterations += 1
+            if not abs(f_new) < abs(fx):
+                break
+            x, fx = x_new, f_new
+
+        if not abs(fx) <= 256 * n * EPS * horner(magnitudes, abs(x)): # a root of the wrong polynomial: the coefficients are off
+            return None
+        roots.append((x, fx))
+
+    return sorted(roots), iterations, evaluations
+
+
+def iter_solve(func:str, condition:float, var="x", vals={}, left_search_bound=1E20, right_search_bound=-1E20, target_dx=1E-50, steps=8, method="brent", guess=None, ftol=0.0):
+    """Solve func(var) = condition. A bracket is searched for outwards from 'guess' (or 0) before handing off to 
+    one of the 'root_finders'. The original pattern search is used if that fails. 'target_dx' and 'ftol' 
+    are the tolerances on the change in x and on the residual."""
+
+    return root_solve(bind(func, var, vals), condition, var, left_search_bound, right_search_bound, target_dx, steps, method, guess, ftol)
+
+
+def root_solve(f, condition:float, var="x", left_search_bound=1E20, right_search_bound=-1E20, target_dx=1E-50, steps=8, method="brent", guess=None, ftol=0.0):
+    """Solve f(x) = condition for a python function 'f' of one variable, as 'iter_solve' does for an expression."""
+    start = time()
+    evaluations = 0
+
+    def g(x):
+        nonlocal evaluations
+        evaluations += 1
+        return real_residual(f, x, condition)
+
+    left_search_bound, right_search_bound = sorted((left_search_bound, right_search_bound))
+    xtol = abs(target_dx)
+    ftol = ftol * max(abs(condition), 1.0)
+
+    # A Newton step from the start says roughly how far away the root is, so the bracket search can start there 
+    # (unless the function can't be evaluated that far out, as happens with exponentials)
+    x0 = min(max(0.0 if guess == None else guess, left_search_bound), right_search_bound)
+    f0, df0 = with_slope(g)(x0)
+    step = None
+    if isfinite(f0) and isfinite(df0) and df0 != 0:
+        x1 = min(max(x0 - 1.1*f0/df0, left_search_bound), right_search_bound)
+        if x1 != x0 and isfinite(g(x1)):
+            step = abs(x1 - x0)
+
+    a, b, fa, fb, found = find_bracket(g, left_search_bound, right_search_bound, x0, step, f0)
+    if not found: # the walk can step over a pair of roots, so look at the whole range before giving up on a bracket
+        brackets = sample_brackets(g, left_search_bound, right_search_bound)
+        if len(brackets) > 0:
+            a, b, fa, fb = min(brackets, key=lambda bracket: abs(bracket[0] + bracket[1] - 2*x0))
+            found = True
+
+    def residual(x): # as g, but not counted as an evaluation by the solver
+        return real_residual(f, x, condition)
+
+    x, iterations, converged = root_finders[method](g, a, b, fa, fb, xtol, ftol)
+    bracket = (a, b) if found else None
+    value = residual(x)
+
+    if found and converged and not abs(value) <= max(abs(fa), abs(fb)): # closed in on a pole, where f changes sign without a root
+        converged = False
+
+    if not converged or not left_search_bound <= x <= right_search_bound:
+        # the walk only gets to exactly 0 by luck, so a residual down at the rounding of the condition counts as a root
+        x, more_iterations, converged = pattern_search(g, left_search_bound, right_search_bound, a if abs(fa) < abs(fb) else b, xtol, max(ftol, EPS**0.5 * max(abs(condition), 1.0)), steps)
+        iterations += more_iterations
+        bracket = None
+        value = residual(x)
+
+    return soln({var: x}, time()-start, percent_err=percent_error(value + condition, condition), converged=converged, iterations=iterations, evaluations=evaluations, bracket=bracket, residual=value)
+
+
+def find_roots(f, condition:float, left_search_bound=-1E20, right_search_bound=1E20, target_dx=1E-50, method="brent", ftol=0.0, degree=None):
+    """Every root of f(x) = condition within the bounds, in increasing order. If 'f' is a polynomial of 'degree', 
+    these are its real roots ('poly_real_roots'). Otherwise each sign change ('sample_brackets') is solved by one of 
+    the 'root_finders', leaving out those across a pole, where |f| grows instead of shrinking. 
+    Returns (roots, iterations, evaluations)."""
+    left_search_bound, right_search_bound = sorted((left_search_bound, right_search_bound))
+
+    found = None if degree == None else poly_real_roots(f, condition, degree)
+    if found != None:
+        roots, iterations, evaluations = found
+        return [x for x, fx in roots if left_search_bound <= x <= right_search_bound], iterations, evaluations
+
+    evaluations = 0
+
+    def g(x):
+        nonlocal evaluations
+        evaluations += 1
+        return real_residual(f, x, condition)
+
+    xtol = abs(target_dx)
+    ftol = ftol * max(abs(condition), 1.0)
+    roots, iterations = [], 0
+
+    for a, b, fa, fb in sample_brackets(g, left_search_bound, right_search_bound):
+        if a == b:
+            roots.append(a)
+            continue
+
+        x, more_iterations, converged = root_finders[method](g, a, b, fa, fb, xtol, ftol)
+        iterations += more_iterations
+        if converged and a <= x <= b and abs(g(x)) <= min(abs(fa), abs(fb)):
+            roots.append(x)
+
+    return roots, iterations, evaluations
+
+
+def batch_solve(func:str, condition, var="x", vals={}, left_search_bound=1E20, right_search_bound=-1E20, target_dx=1E-50, guess=None, ftol=0.0, max_iter=200):
+    """Solve func(var) = condition for whole arrays of conditions and/or known values at once. 
+    Brackets are searched for outwards from 'guess' (or 0) for every element together, then narrowed with 
+    the Illinois variant of regula falsi. Returns a soln whose values and 'converged' mask are arrays."""
+    import numpy as np
+
+    vals = uar(dict(vals), numpy_function_toolkit())
+    shape = np.broadcast(np.asarray(condition), *[np.asarray(vals[name]) for name in vals if isinstance(vals[name], (np.ndarray, list, tuple))]).shape
+    return batch_root_solve(bind(func, var, vals), condition, var, left_search_bound, right_search_bound, target_dx, guess, ftol, max_iter, shape)
+
+
+def batch_root_solve(f, condition, var="x", left_search_bound=1E20, right_search_bound=-1E20, target_dx=1E-50, guess=None, ftol=0.0, max_iter=200, shape=None):
+    """Solve f(x) = condition for a python function 'f' of an array, as 'batch_solve' does for an expression. 
+    'shape' is that of the arrays 'f' works with, if it can't be told from f at 'guess' and the condition."""
+    import numpy as np
+
+    start = time()
+    condition = np.asarray(condition, dtype=float)
+    if shape == None:
+        with np.errstate(all="ignore"):
+            shape = np.broadcast(condition, np.asarray(f(0.0 if guess == None else guess))).shape
+    evaluations = 0
+
+    def g(x):
+        nonlocal evaluations
+        evaluations += 1
+        with np.errstate(all="ignore"):
+            return np.broadcast_to(f(x) - condition, shape).astype(float)
+
+    lo, hi = sorted((left_search_bound, right_search_bound))
+    xtol = abs(target_dx)
+    ftol = ftol * np.maximum(np.abs(condition), 1.0)
+
+    # Walk outwards in doubling steps until each element changes sign
+    x0 = np.clip(np.broadcast_to(0.0 if guess == None else guess, shape).astype(float), lo, hi)
+    f0 = g(x0)
+    a, b, fa, fb = x0.copy(), x0.copy(), f0.copy(), f0.copy()
+    best_x, best_f = x0.copy(), f0.copy()
+    found = f0 == 0
+    last = {1: (x0, f0), -1: (x0, f0)}
+    step = 1E-2 * np.maximum(np.abs(x0), 1.0)
+
+    while not np.all(found) and np.any(step <= hi - lo):
+        for direction in last:
+            last_x, last_f = last[direction]
+            x = np.clip(x0 + direction*step, lo, hi)
+            fx = g(x)
+            ok = np.isfinite(fx)
+
+            change = ~found & ok & ((fx == 0) | ((fx < 0) != (last_f < 0)))
+            upward = last_x < x
+            a = np.where(change, np.where(upward, last_x, x), a)
+            b = np.where(change, np.where(upward, x, last_x), b)
+            fa = np.where(change, np.where(upward, last_f, fx), fa)
+            fb = np.where(change, np.where(upward, fx, last_f), fb)
+            found |= change
+
+            better = ok & (np.abs(fx) < np.abs(best_f))
+            best_x, best_f = np.where(better, x, best_x), np.where(better, fx, best_f)
+            last[direction] = (np.where(ok, x, last_x), np.where(ok, fx, last_f))
+
+        step *= 2
+
+    # Illinois iteration on every bracketed element at once
+    x = np.where(found, np.where(np.abs(fa) < np.abs(fb), a, b), best_x)
+    fx = np.where(found, np.minimum(np.abs(fa), np.abs(fb)), best_f)
+    converged = found & ((fa == 0) | (fb == 0))
+    active = found & ~converged
+    side = np.zeros(shape) # which end was moved last: -1 for a, 1 for b
+
+    for i in range(max_iter):
+        if not np.any(active):
+            break
+
+        with np.errstate(all="ignore"):
+            xm = b - fb*(b - a)/(fb - fa)
+        xm = np.where(np.isfinite(xm) & (xm > a) & (xm < b), xm, 0.5*(a + b))
+        fm = g(xm)
+
+        move_a = active & ((fm < 0) == (fa < 0))
+        move_b = active & ~move_a
+        fb = np.where(move_a & (side == -1), 0.5*fb, fb) # an end that hasn't moved twice in a row gets its value halved
+        fa = np.where(move_b & (side == 1), 0.5*fa, fa)
+        a, fa = np.where(move_a, xm, a), np.where(move_a, fm, fa)
+        b, fb = np.where(move_b, xm, b), np.where(move_b, fm, fb)
+        side = np.where(move_a, -1, np.where(move_b, 1, side))
+
+        done = active & ((np.abs(fm) <= ftol) | (np.abs(xm - x) <= xtol + 4*EPS*np.abs(xm)) | (b - a <= xtol + 4*EPS*np.abs(xm)))
+        x, fx = np.where(active, xm, x), np.where(active, fm, fx)
+        converged |= done
+        active &= ~done
+
+    with np.errstate(all="ignore"):
+        percent_err = 100*np.abs(g(x))/np.where(condition == 0, 1.0, np.abs(condition))
+
+    return soln({var: x}, time()-start, percent_err=percent_err, converged=converged, iterations=i, evaluations=evaluations)
 
 
 def iter_solve2(func:str, condition:float, var="x", vals={}, left_search_bound=1E20, right_search_bound=-1E20, target_dx=1E-20, steps=8):
@@ -118,7 +1202,7 @@ def iter_solve2(func:str, condition:float, var="x", vals={}, left_search_bound=1
 
     start = time()
 
-    def f(x): return eval(func, uar(vals, {var: x}))
+    f = bind(func, var, vals)
     def e(x): return abs(f(x) - condition)
     def ime(some_list): return some_list.index(min(some_list))
 
@@ -142,211 +1226,1763 @@ def iter_solve2(func:str, condition:float, var="x", vals={}, left_search_bound=1
         return soln({var: x}, time()-start, percent_err=100*abs(f(x)-condition)/condition)
 
 
+BLOCK_STARTS = 4 # starting points 'block_solve' tries before giving up on a block
+
+
+def block_solve(exprs:list, variables:list, vals={}, bounds={}, guess={}, target_dx=1E-20, ftol=1E-12, max_iter=200):
+    """Solve a block of coupled equations for all of their unknowns at once with a Levenberg-Marquardt iteration.
+    'exprs' is a list of (lhs, rhs) strings and 'bounds' maps variables to their '!bound' limits."""
+    import numpy as np
+
+    start = time()
+    variables = tuple(variables)
+    funcs = [bind(f"({lhs}\n) - ({rhs}\n)", variables, vals) for lhs, rhs in exprs]
+    scales = [bind(f"abs({rhs}\n)", variables, vals) for lhs, rhs in exprs]
+
+    lo = np.array([float(bounds[var][0]) if var in bounds else -np.inf for var in variables])
+    hi = np.array([float(bounds[var][1]) if var in bounds else np.inf for var in variables])
+
+    evaluations = 0
+
+    def residuals(X):
+        """Residuals of every equation (rows) at every point (columns) of X."""
+        nonlocal evaluations
+        evaluations += X.shape[1]
+        with np.errstate(all="ignore"): # (invalid points just give nan residuals)
+            try:
+                return np.array([np.broadcast_to(f(*X), X.shape[1]) for f in funcs], dtype=float)
+            except TypeError: # some function in the equations can't take arrays, so go point by point
+                return np.array([[f(*point) for point in X.T] for f in funcs], dtype=float)
+
+    def jacobian(x):
+        """Residuals at x and their Jacobian, from a perturbation of each variable evaluated as one batch."""
+        h = 1.5E-8 * np.maximum(np.abs(x), 1.0)
+        R = residuals(x[:, None] + np.hstack([np.zeros((n, 1)), np.diag(h)]))
+        return R[:, 0], (R[:, 1:] - R[:, :1]) / h
+
+    def descend(x):
+        """Levenberg-Marquardt iteration from x. Returns where it stops and the iterations it took."""
+        damping = 1E-3
+
+        for i in range(max_iter):
+            r, J = jacobian(x)
+            cost = r @ r
+            g = J.T @ r
+            A = J.T @ J
+
+            improved = False
+            while damping < 1E16:
+                step = np.linalg.lstsq(A + damping * np.diag(np.diag(A) + 1E-12), -g, rcond=None)[0]
+                x_new = np.clip(x + step, lo, hi)
+                r_new = residuals(x_new[:, None])[:, 0]
+
+                if r_new @ r_new <= cost: # improvement, so trust the Newton step a bit more
+                    damping = max(damping / 10, 1E-12)
+                    improved = True
+                    break
+                damping *= 10
+
+            if not improved: # stuck at a minimum of the residuals
+                break
+
+            dx = np.abs(x_new - x)
+            x = x_new
+            if np.all(dx <= target_dx + 4E-16 * np.abs(x)):
+                break
+
+        return x, i + 1
+
+    n = len(variables)
+    x0 = np.clip(np.array([float(guess.get(var, 1.0)) for var in variables]), lo, hi)
+    rng = np.random.default_rng(0) # the same starts every time, so solves are repeatable
+    iterations, best = 0, None
+
+    # Equal starting values can keep a symmetric system (like a*b = 6, a + b = 5) on a line where a = b, 
+    # so a start that doesn't converge is retried from a few scattered around it
+    for attempt in range(BLOCK_STARTS):
+        start_x = x0 if attempt == 0 else np.clip(x0 + rng.normal(size=n) * np.maximum(np.abs(x0), 1.0), lo, hi)
+        x, more_iterations = descend(start_x)
+        iterations += more_iterations
+
+        r = residuals(x[:, None])[:, 0]
+        rhs = np.array([s(*x) for s in scales])
+        converged = bool(np.all(np.abs(r) <= ftol * np.maximum(1.0, rhs)))
+        if best == None or converged or np.max(np.abs(r)) < np.max(np.abs(best[1])):
+            best = (x, r, rhs, converged)
+        if converged:
+            break
+
+    x, r, rhs, converged = best
+    percent_err = float(np.max(100 * np.abs(r) / np.where(rhs == 0, 1.0, rhs)))
+    rank = None
+
+    if converged: # a solution isn't worth much if the equations don't pin it down (e.g. one is the other rearranged)
+        J = jacobian(x)[1] * np.maximum(np.abs(x), 1.0) / np.maximum(1.0, rhs)[:, None] # (scaled, so the variables and equations compare)
+        sv = np.linalg.svd(J, compute_uv=False)
+        rank = int(np.sum(sv > 1E-6 * sv[0])) if len(sv) > 0 and sv[0] > 0 else 0
+        converged = rank == n
+    
+    return soln(dict(zip(variables, x.tolist())), time()-start, percent_err=percent_err, converged=converged, iterations=iterations, evaluations=evaluations, residual=float(np.max(np.abs(r))), rank=rank)
+
+
+_tokens = compile_re(r"""
+    (?P<space>[ \t\r\f\v]+)
+  | (?P<comment>\#[^\n]*)
+  | (?P<flag>![^!#\n]*)
+  | (?P<string>'[^'\n]*'|"[^"\n]*")
+  | (?P<const>&[\w\\]+)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[^\W\d]\w*)
+  | (?P<op>\*\*|==|<=|>=|.)
+""", VERBOSE)
+
+class fr_line:
+    """One line of a .fr file, split into its equation, flags, comment, string literals and constant references."""
+    __slots__ = ("number", "text", "lhs", "rhs", "lhs_names", "rhs_names", "flags", "comment", "strings", "constants", "is_equation", "is_comment", "is_blank", "error", "parse_time")
+
+    def __init__(self, number:int):
+        self.number = number    # line number in the file, starting at 1
+        self.text = ""          # the line as python will see it ('^' as '**', constants replaced by their values)
+        self.lhs = None         # python source of each side of the equation, without flags or comments
+        self.rhs = None
+        self.lhs_names = []     # names on each side, in order of appearance
+        self.rhs_names = []
+        self.flags = []         # (flag, [arguments]) pairs, e.g. ("bound", ["t", "0", "10"])
+        self.comment = None
+        self.strings = []
+        self.constants = []
+        self.is_equation = False
+        self.is_comment = False
+        self.is_blank = True
+        self.error = None       # a problem found while parsing, e.g. converting between units of different dimensions
+        self.parse_time = 0.0
+
+
+    def __str__(self):
+        return self.text
+
+
+    def normalized(self):
+        """The equation and its flags with whitespace and comments removed, for telling whether a line really changed."""
+        flags = "".join([f"!{flag} {' '.join(args)}" for flag, args in self.flags])
+        return "".join(f"{self.lhs}={self.rhs}".split()) + flags
+
+
+def parse_line(text:str, number=1, constants={}, units=None):
+    """Lex and parse one line of a .fr file in a single pass. Returns an 'fr_line'. If a 'unit_registry' is 
+    given as 'units', each convert() between two quoted units is replaced by its factor, and units that 
+    can't be converted are noted in the line's 'error'."""
+    started = perf_counter()
+    line = fr_line(number)
+    sides, names, equals = ([], []), ([], []), 0
+    code = []
+
+    for token in _tokens.finditer(text):
+        kind, value = token.lastgroup, token.group()
+
+        if kind == "comment":
+            line.comment = value[1:].strip()
+            line.is_comment = line.is_blank
+
+        elif kind == "flag":
+            args = value[1:].split()
+            line.flags.append((args[0] if len(args) > 0 else "", args[1:]))
+
+        else: # part of the equation itself. Flags and comments run to the end of the line, so nothing follows them here.
+            if kind == "const" and value in constants:
+                line.constants.append(value)
+                value = constants[value][1]
+            elif value == "^":
+                value = "**"
+
+            if kind != "space":
+                line.is_blank = False
+            
+            if value == "=":
+                equals += 1
+            elif equals < 2:
+                sides[equals].append(value)
+                if kind == "string":
+                    line.strings.append(value[1:-1])
+                elif kind == "name" and not iskeyword(value) and value not in names[equals]:
+                    names[equals].append(intern(value)) # a variable's name is shared by every line it's on
+
+        code.append(value)
+
+        if value == ")" and units != None and equals < 2 and len(line.strings) > 1:
+            call = conversion_call(sides[equals])
+            if call != None:
+                start, from_unit, to_unit = call
+                try:
+                    factor = repr(units.factor(from_unit, to_unit))
+                except (LookupError, ValueError) as e:
+                    line.error = line.error or str(e)
+                else:
+                    span = len(sides[equals]) - start
+                    del sides[equals][start:], code[-span:]
+                    sides[equals].append(factor)
+                    code.append(factor)
+
+    line.text = "".join(code)
+    line.is_equation = equals == 1
+    if line.is_equation:
+        line.lhs, line.rhs = "".join(sides[0]), "".join(sides[1])
+        line.lhs_names, line.rhs_names = names
+
+    line.parse_time = perf_counter() - started
+    return line
+
+
+def conversion_call(tokens:list):
+    """If a list of tokens ends with convert() between two quoted units, returns where the call starts and the units."""
+    parts = [] # (index, token) of the last six tokens that aren't spaces
+    for i in range(len(tokens) - 1, -1, -1):
+        if not tokens[i].isspace():
+            parts.append((i, tokens[i]))
+            if len(parts) == 6:
+                break
+
+    if len(parts) < 6:
+        return None
+    (start, name), (i, bracket), (i, from_unit), (i, comma), (i, to_unit), (i, end) = reversed(parts)
+    if name == "convert" and bracket == "(" and comma == "," and from_unit[0] in "'\"" and to_unit[0] in "'\"":
+        return start, from_unit[1:-1], to_unit[1:-1]
+    return None
+
+
+def parse_fr(text:str, constants={}, units=None):
+    """Parse the text of a .fr file. Returns a list of 'fr_line's, one per line of text."""
+    return [parse_line(line, number, constants, units) for number, line in enumerate(text.split("\n"), 1)]
+
+
+def read_fr(fp:str, constants={}, units=None):
+    """Parse a .fr file a line at a time, through a memory map so that its text is never held in memory whole. 
+    Yields an 'fr_line' for each line with an equation or flags on it; blank and comment lines are dropped 
+    as they are read (their numbers are skipped)."""
+    from mmap import mmap, ACCESS_READ
+
+    with open(fp, "rb") as f:
+        if stat(fp).st_size == 0: # can't map an empty file
+            return
+
+        with mmap(f.fileno(), 0, access=ACCESS_READ) as text:
+            for number, raw in enumerate(iter(text.readline, b""), 1):
+                raw = raw.strip()
+                if len(raw) > 0 and raw[:1] != b"#":
+                    line = parse_line(raw.decode("utf-8"), number, constants, units)
+                    if not line.is_blank or len(line.flags) > 0:
+                        yield line
+
+
 class eqn_parser:
+    __slots__ = ("line", "knowns", "equation", "is_comment", "not_an_equation", "exprs", "flags", "lhs_vars", "rhs_vars", "cond_vars", 
+                 "bound_var", "l_bound", "r_bound", "root_var", "root_pick", "dist_var", "dist", "key_var", "conditional", "satisfied", "too_many_unknowns", "unsolvable")
 
-    def __init__(self, equation:str, knowns:dict):
+    def __init__(self, equation, knowns:dict):
+        self.line = equation if type(equation) == fr_line else parse_fr(equation)[0]
         self.knowns = knowns
-        self.equation = equation
-        self.vars = self.vf(self.equation)
-        self.exprs = self.equation.split("!")[0].split("=")
-        self.not_an_equation = len(self.exprs) != 2
-        self.is_comment = self.equation.startswith("#")
+        self.equation = self.line.text
+        self.is_comment = self.line.is_comment
+        self.not_an_equation = not self.line.is_equation
+        self.exprs = [self.line.lhs, self.line.rhs] if self.line.is_equation else [self.line.text]
+        self.flags = self.line.flags
+        self.lhs_vars = self.unknowns(self.line.lhs_names)
+        self.rhs_vars = self.unknowns(self.line.rhs_names)
+        self.cond_vars = []
+
+        self.bound_var = None
+        self.l_bound = None
+        self.r_bound = None
+        self.root_var = None
+        self.root_pick = None   # arguments of a '!root' flag after the variable, e.g. ["max"]
+        self.dist_var = None
+        self.dist = None        # arguments of a '!dist' flag after the variable, e.g. ["normal", "0.01"]
+        self.key_var = False
+        self.conditional = False
+        self.satisfied = False
+
+        for flag, args in self.flags:
+
+            if flag == "bound":
+                self.bound_var = args[0]
+                self.l_bound = min([float(arg) for arg in args[1:]])
+                self.r_bound = max([float(arg) for arg in args[1:]])
+
+            elif flag == "root":
+                self.root_var = args[0]
+                self.root_pick = args[1:]
+
+            elif flag == "dist":
+                self.dist_var = args[0]
+                self.dist = args[1:]
+
+            elif flag == "key":
+                self.key_var = True
+
+            elif flag == "if":
+                self.conditional = True
+                self.satisfied = self.check(args)
+
+        if self.line.is_equation:
+            self.too_many_unknowns = len(self.lhs_vars) > 1 or len(self.rhs_vars) > 1 or (len(self.lhs_vars) == 1 and len(self.rhs_vars) == 1)
+        else:
+            self.too_many_unknowns = None
 
-        if len(self.exprs) == 2:
+        self.unsolvable = self.is_comment or self.too_many_unknowns or self.not_an_equation
+
+
+    @property
+    def vars(self):
+        """The unknown variables on both sides of the equation."""
+        return self.unknowns(self.line.lhs_names + self.line.rhs_names)
 
-            self.lhs_vars = self.vf(self.exprs[0])
-            self.rhs_vars = self.vf(self.exprs[1].split("!")[0].split("#")[0])
-                
-            self.too_many_unknowns = len(self.lhs_vars) > 1 or len(self.rhs_vars) > 1 or (len(self.lhs_vars) == 1 and len(self.rhs_vars) == 1)
 
-            self.flags = self.equation.split("!")[1:]
-            if len(self.flags) > 0:
-                for flag in self.flags:
-                    
-                    if "bound" in flag:
-                        args = flag.split()[1:] # all arguments before next flag
-
-                        self.bound_var = args[0]
-                        self.l_bound = min(args[1:])
-                        self.r_bound = max(args[1:])
-
-                    else:
-                        self.bound_var = None
-                        self.l_bound = None
-                        self.r_bound = None
-
-
-                    if "key" in flag:
-                        self.key_var = True
-
-                    else:
-                        self.key_var = False
-
-                    if "if" in flag:
-                        self.conditional = True
-                        args = flag.split()[1:]
-
-                        # replace variables with values if possible
-                        for i in 0, 2:
-                            if args[i] in knowns:
-                                args[i] = knowns[args[i]]
-                            else:
-                                args[i] = args[i]
-
-                        conditions = {
-                            "<":  float(args[0]) <  float(args[2]),
-                            ">":  float(args[0]) >  float(args[2]),
-                            "=":  float(args[0]) == float(args[2]),
-                            "==": float(args[0]) == float(args[2]),
-                            "<=": float(args[0]) <= float(args[2]),
-                            ">=": float(args[0]) >= float(args[2]),
-                            "/=": float(args[0]) != float(args[2])
-                        }
-                    
-                        self.satisfied = conditions[args[1]]
-
-                    else:
-                        self.conditional = False
-                        self.satisfied = False
+    def check(self, args:list):
+        """Returns whether an '!if' condition is satisfied, or None if it still has unknown variables."""
+        args = list(args)
 
+        # replace variables with values if possible
+        for i in 0, 2:
+            if args[i] in self.knowns:
+                args[i] = self.knowns[args[i]]
             else:
-                self.bound_var = None
-                self.l_bound = None
-                self.r_bound = None
-                self.key_var = False
-                self.conditional = False
-                self.satisfied = False
-                
-        else: 
-        
-            self.flags = []
-    
-            self.lhs_vars = []
-            self.rhs_vars = []
+                self.cond_vars += self.vf(args[i])
 
-            self.too_many_unknowns = None
+        if len(self.cond_vars) > 0: # condition can't be checked until its variables are known
+            return None
 
-        self.unsolvable = self.is_comment or self.too_many_unknowns or self.not_an_equation
+        conditions = {
+            "<":  float(args[0]) <  float(args[2]),
+            ">":  float(args[0]) >  float(args[2]),
+            "=":  float(args[0]) == float(args[2]),
+            "==": float(args[0]) == float(args[2]),
+            "<=": float(args[0]) <= float(args[2]),
+            ">=": float(args[0]) >= float(args[2]),
+            "/=": float(args[0]) != float(args[2])
+        }
 
+        return conditions[args[1]]
 
-    def vf(self, expr:str):
-        """'Variable finder'. Returns a list of variables in an expression"""
-        found_vars = []
 
-        strings = findall(r"'([^']*)'", expr)
-        candidates = findall("[a-z]+", expr, IGNORECASE)
+    def unknowns(self, names:list):
+        """Returns the names in a list that are not known values or functions."""
+        return [name for name in names if name not in self.knowns]
 
-        for i in strings:
-            if i in candidates: # This excludes all string occurences from the list of variables
-                candidates.remove(i)
 
-        for i in candidates:
-            if i not in self.knowns and i not in found_vars:
-                found_vars.append(i)
+    def form(self, expr:str, var:str):
+        """Returns how 'var' appears in one side of the equation: "explicit", "linear", "polynomial" or "nonlinear"."""
+        return expr_form(expr, var)
 
-        return found_vars
+
+    def vf(self, expr:str):
+        """'Variable finder'. Returns a list of variables in an expression"""
+        line = parse_line(f"{expr} = 0")
+        return self.unknowns(line.lhs_names)
         
 
-def solve_line(line:str, vals={}, target_dx=1E-20):
-    """Parse an equation as a string and solve for a single unknown variable after subbing in known values."""
+def solve_line(line, vals={}, target_dx=1E-20, method="brent", guess={}):
+    """Parse an equation (a string or a parsed 'fr_line') and solve for a single unknown variable after subbing in known values."""
 
     line_info = eqn_parser(line, vals)
 
+    if line_info.line.error != None:
+        return f"Skipped line due to bad units ({line_info.line.error}): {line}"
+
     if line_info.too_many_unknowns:
         return f"Skipped unsolvable line due to too many unknowns: \n   {line}" # line is unsolvable due to too many unknowns.
 
     if line_info.unsolvable:
         return None
 
-    elif len(line_info.lhs_vars) == 1 and len(line_info.rhs_vars) == 0:
-    
-        if line_info.bound_var == line_info.lhs_vars[0]:
-            bounds = line_info.l_bound, line_info.r_bound
-            print(f"\n\n------------------------------------\n\nBOUND FLAG: {bounds}")
-        else:
-            bounds = [-1E20, 1E20]
+    if line_info.conditional:
+        log.debug("IF FLAG: condition is %s", line_info.satisfied)
+        if not line_info.satisfied:
+            return f"Skipped line due to unsatisfied condition: {line}"
 
-        if line_info.conditional:
-            print(f"\n\n------------------------------------\n\nIF FLAG: condition is {line_info.satisfied}")
-            if not line_info.satisfied:
-                return f"Skipped line due to unsatisfied condition: {line}"
-            else:
-                pass
-
-        return iter_solve(
-            func = line_info.exprs[0],
-            condition = eval(line_info.exprs[1].split("!")[0], vals),
-            var = line_info.lhs_vars[0],
-            vals = vals,
-            left_search_bound = float(bounds[0]),
-            right_search_bound = float(bounds[1]),
-            target_dx = target_dx
-        )
+    if len(line_info.lhs_vars) == 1 and len(line_info.rhs_vars) == 0:
+        var, func, condition = line_info.lhs_vars[0], line_info.exprs[0], line_info.exprs[1]
 
     elif len(line_info.rhs_vars) == 1 and len(line_info.lhs_vars) == 0:
+        var, func, condition = line_info.rhs_vars[0], line_info.exprs[1], line_info.exprs[0]
 
-        if line_info.bound_var == line_info.rhs_vars[0]:
-            bounds = line_info.l_bound, line_info.r_bound
-            print(f"\n\n------------------------------------\n\nBOUND FLAG: {bounds}")
-        else:
-            bounds = [-1E20, 1E20]
+    else:
+        return None
+
+    if line_info.bound_var == var:
+        bounds = line_info.l_bound, line_info.r_bound
+        log.debug("BOUND FLAG: %s", bounds)
+    else:
+        bounds = [-1E20, 1E20]
+
+    condition = evaluate(condition, vals)
 
-        return iter_solve(
-            func = line_info.exprs[1].split("!")[0],
-            condition = eval(line_info.exprs[0], vals),
-            var = line_info.rhs_vars[0],
+    form = line_info.form(func, var)
+
+    if line_info.root_var == var and form not in ("explicit", "linear"): # choose from all of the roots, not just the nearest
+        line_soln = pick_root(func, condition, var, vals, float(bounds[0]), float(bounds[1]), line_info.root_pick, target_dx, method)
+        if type(line_soln) == str:
+            return f"{line_soln}: {line}"
+        elif line_soln != None:
+            return line_soln
+
+    line_soln = None
+
+    if form in ("explicit", "linear"): # most lines can be solved with an evaluation or two
+        line_soln = direct_solve(func, condition, var, vals, float(bounds[0]), float(bounds[1]))
+        if line_soln != None:
+            return line_soln
+
+    elif form == "polynomial":
+        line_soln = poly_solve(func, condition, var, vals, float(bounds[0]), float(bounds[1]), guess.get(var))
+
+    if line_soln == None:
+        line_soln = iter_solve(
+            func = func,
+            condition = condition,
+            var = var,
             vals = vals,
             left_search_bound = float(bounds[0]),
             right_search_bound = float(bounds[1]),
-            target_dx = target_dx
+            target_dx = target_dx,
+            method = method,
+            guess = guess.get(var)
         )
 
-    else:
+        if not line_soln.converged:
+            return f"Could not converge on {var} (closest was {var} = {line_soln.soln[var]:.6g}, off by {line_soln.residual:.3g}): \n   {line}"
+
+    # A '!root' line gets here when none of its roots change sign, so the one found (which only touches zero, 
+    # like that of x^2 = 0) is all there is to choose from
+    if line_info.root_var == var and select_root([line_soln.soln[var]], line_info.root_pick) == None:
+        return f"Found 1 root of {var}, so there is no root {' '.join(line_info.root_pick)}: {line}"
+
+    return line_soln
+
+
+def root_set(func:str, condition:float, var="x", vals={}, left_search_bound=-1E20, right_search_bound=1E20, target_dx=1E-50, method="brent"):
+    """All of the roots of func(var) = condition within the bounds ('find_roots'). Root sets are kept in 'root_sets' 
+    by equation, input values and search range, so choosing another of the roots doesn't search again. 
+    Returns (roots, iterations, evaluations), with no iterations or evaluations for a set that was kept."""
+    inputs = tuple(sorted([(name, vals[name]) for name in compile_expr(func).co_names if name != var and type(vals.get(name)) in (int, float)]))
+    key = (func, var, condition, inputs, left_search_bound, right_search_bound, target_dx, method)
+    roots = root_sets.lookup(key)
+
+    if roots is not False:
+        return roots, 0, 0
+
+    degree = expr_degree(func, var) if expr_form(func, var) == "polynomial" else None
+    roots, iterations, evaluations = find_roots(bind(func, var, vals), condition, left_search_bound, right_search_bound, target_dx, method, degree=degree)
+    root_sets.store(key, roots)
+    return roots, iterations, evaluations
+
+
+def select_root(roots:list, pick:list):
+    """Choose from roots in increasing order by the arguments of a '!root' flag: "min", "max", "near" a value, or an 
+    index (from 0, or negative to count down from the largest). Returns None if there is no such root."""
+    if len(pick) == 0 or (pick[0] not in ("min", "max", "near") and not pick[0].lstrip("+-").isdigit()) or (pick[0] == "near" and len(pick) < 2):
+        raise ValueError(f"'!root' takes min, max, near <value> or an index, not '{' '.join(pick)}'")
+
+    if len(roots) == 0:
         return None
+    elif pick[0] == "min":
+        return roots[0]
+    elif pick[0] == "max":
+        return roots[-1]
+    elif pick[0] == "near":
+        return min(roots, key=lambda x: abs(x - float(pick[1])))
 
+    index = int(pick[0])
+    return roots[index] if -len(roots) <= index < len(roots) else None
+
+
+def pick_root(func:str, condition:float, var="x", vals={}, left_search_bound=-1E20, right_search_bound=1E20, pick=["min"], target_dx=1E-50, method="brent"):
+    """Solve func(var) = condition for the root chosen by a '!root' flag ('select_root') out of all those within 
+    the bounds. Returns a warning if there aren't enough roots, or None if there are none that change sign, 
+    so that the caller can look for one that doesn't (like that of x^2 = 0)."""
+    start = time()
+    roots, iterations, evaluations = root_set(func, condition, var, vals, left_search_bound, right_search_bound, target_dx, method)
+    x = select_root(roots, pick)
+
+    if x == None:
+        return f"Found {len(roots)} root(s) of {var}, so there is no root {' '.join(pick)}" if len(roots) > 0 else None
+
+    value = bind(func, var, vals)(x)
+    return soln({var: x}, time()-start, percent_err=percent_error(value, condition), iterations=iterations, evaluations=evaluations + 1, residual=value - condition)
+
+
+class eqn_graph:
+    """Bipartite graph between the equations of a system and the variables they contain."""
+
+    def __init__(self, lines:list, knowns:dict):
+        """'lines' are the 'fr_line's of a parsed system."""
+        self.lines = lines
+        self.needs = {} # line index -> variables the equation contains (including '!if' variables)
+        self.uses = {}  # variable -> indices of the equations that contain it
+        self.parsed = {}
+
+        for i, line in enumerate(lines):
+            line_info = eqn_parser(line, knowns)
+
+            if line_info.is_comment or line_info.not_an_equation:
+                continue
+            
+            self.parsed[i] = line_info
+            self.needs[i] = set(line_info.lhs_vars + line_info.rhs_vars + line_info.cond_vars)
+            for var in self.needs[i]:
+                self.uses.setdefault(var, []).append(i)
+
+        self.reset()
+
+
+    def copy(self):
+        """Returns a graph of the same equations with scheduling state of its own, so that systems sharing 
+        a parse can be solved at the same time."""
+        graph = eqn_graph.__new__(eqn_graph)
+        graph.lines, graph.needs, graph.uses, graph.parsed = self.lines, self.needs, self.uses, self.parsed
+        graph.reset()
+        return graph
 
-class frees:
-    """FreES engine for solving systems of equations."""
 
-    def __init__(self, exprs:str, accuracy=1E-1000, toolkit={}):
-        self.exprs = exprs
+    def reset(self):
+        """Forget all known variables so the system can be scheduled again."""
+        self.known = set()
+        self.missing = {i: len(self.needs[i]) for i in self.needs}
+        self.ready = [i for i in self.needs if self.missing[i] == 1] # already in line order, so this is a valid heap
+        self.given_up = set()
+        self.blocks = [] # coupled groups found at the last stall, the next to solve last
 
-        for const in default_constant_toolkit():
-            self.exprs = self.exprs.replace(const, default_constant_toolkit()[const][1])
 
-        print(f"\n\n------------------------------------\n\nSYSTEM:\n{self.exprs}")
-        self.lines = self.exprs.strip().split("\n")
+    def pop(self):
+        """Returns the index of the next equation with a single unknown, or None if the system has stalled."""
+        while len(self.ready) > 0:
+            i = heappop(self.ready)
+            if self.missing[i] == 1: # skip equations whose unknown was found by an earlier line
+                return i
+
+        return None
+
+
+    def solved(self, var:str):
+        """Mark a variable as known and queue every equation it leaves with a single unknown."""
+        if var in self.known:
+            return
+
+        self.known.add(var)
+        for i in self.uses.get(var, []):
+            self.missing[i] -= 1
+            if self.missing[i] == 1:
+                heappush(self.ready, i)
+
+
+    def stalled(self):
+        """Returns the indices of equations that still have more than one unknown."""
+        return [i for i in self.needs if self.missing[i] > 1]
+
+
+    def block(self):
+        """Returns the indices and unknowns of the next group of coupled equations that can be solved 
+        together (as many equations as unknowns, and no unknowns shared with the rest of the system), or None. 
+        The groups are all found at once ('find_blocks') and handed out in turn while they still stand."""
+        while len(self.blocks) > 0:
+            group, variables = self.blocks.pop()
+            unknowns = set([var for i in group for var in self.needs[i] - self.known])
+            if unknowns == set(variables) and not any([i in self.given_up for i in group]):
+                return group, variables
+
+        self.blocks = self.find_blocks()[::-1]
+        return self.blocks.pop() if len(self.blocks) > 0 else None
+
+
+    def find_blocks(self):
+        """Returns every group of coupled equations that can be solved together, each after the groups it depends on."""
+        eqns = [i for i in self.stalled() if i not in self.given_up and not self.parsed[i].conditional]
+        unknowns = {i: sorted(self.needs[i] - self.known) for i in eqns}
+        match = {} # variable -> equation it is solved from
+
+        def augment(i, seen):
+            for var in unknowns[i]:
+                if var not in seen:
+                    seen.add(var)
+                    if var not in match or augment(match[var], seen):
+                        match[var] = i
+                        return True
+            return False
+
+        for i in eqns:
+            augment(i, set())
+
+        solves = {match[var]: var for var in match} # equation -> the variable it is solved for
+
+        def depends_on(i):
+            return [match[var] for var in unknowns[i] if var in match]
+
+        # Tarjan's algorithm. Strongly connected groups come out with the groups they depend on first.
+        index, low, stack, on_stack = {}, {}, [], set()
+        blocks = []
+
+        for root in set(match.values()):
+            if root in index:
+                continue
+
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(depends_on(root)))]
+
+            while len(work) > 0:
+                i, edges = work[-1]
+
+                for j in edges:
+                    if j not in index:
+                        index[j] = low[j] = len(index)
+                        stack.append(j)
+                        on_stack.add(j)
+                        work.append((j, iter(depends_on(j))))
+                        break
+                    elif j in on_stack:
+                        low[i] = min(low[i], index[j])
+
+                else:
+                    work.pop()
+                    if len(work) > 0:
+                        low[work[-1][0]] = min(low[work[-1][0]], low[i])
+
+                    if low[i] == index[i]:
+                        group = []
+                        while len(group) == 0 or group[-1] != i:
+                            group.append(stack.pop())
+                            on_stack.discard(group[-1])
+
+                        variables = [solves[j] for j in sorted(group)]
+                        if all(var in variables for j in group for var in unknowns[j]):
+                            blocks.append((sorted(group), variables))
+
+        return blocks
+
+
+class solve_cache:
+    """Keeps the last parse of a system and the result of each equation it solved, 
+    so that re-solving after a small edit only re-solves the equations the edit affects."""
+
+    def __init__(self, max_results=100000):
+        self.max_results = max_results
+        self.parse_key = None
+        self.parsed = None
+        self.graph = None
+        self.results = OrderedDict() # (equations, inputs, settings) -> soln, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock() # several solves may share a cache from different threads
+
+
+    def lookup(self, key):
+        """Returns the cached result for a key (with no solve time, since none was spent), or False if there isn't one."""
+        with self.lock:
+            if key not in self.results:
+                self.misses += 1
+                return False
+
+            self.hits += 1
+            self.results.move_to_end(key)
+            result = self.results[key]
+
+        if isinstance(result, soln):
+            return soln(dict(result.soln), 0, percent_err=result.percent_err, converged=result.converged, bracket=result.bracket, residual=result.residual, cached=True, rank=result.rank)
+        
+        return result
+
+
+    def store(self, key, result):
+        with self.lock:
+            self.results[key] = result
+            self.results.move_to_end(key)
+
+            while len(self.results) > self.max_results:
+                self.results.popitem(last=False)
+
+
+root_sets = solve_cache(max_results=10000) # every root of recently solved lines, for 'root_set'
+
+
+def default_cache_dir():
+    """Folder for the solution cache shared by every FreES window, command line run and plot on this machine."""
+    return path.join(path.expanduser("~"), ".cache", "frees")
+
+
+class disk_cache:
+    """Solved systems saved as files named by a hash of everything the solution depends on: the parsed equations, 
+    the solver settings, any bindings and guesses, and the contents of units.json. Re-opening and solving an 
+    unchanged file loads its solution instead. The least recently used files are deleted beyond 'max_bytes'."""
+
+    def __init__(self, folder=None, max_bytes=64*2**20):
+        self.folder = default_cache_dir() if folder == None else folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        makedirs(self.folder, exist_ok=True)
+        self.size = sum([stat(path.join(self.folder, fp)).st_size for fp in listdir(self.folder) if fp.endswith(".json")])
+
+
+    def key(self, parts):
+        """Returns the hash naming the entry for a JSON-able description of a solve."""
+        from hashlib import sha256
+        return sha256(dumps(parts, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+    def lookup(self, key:str):
+        """Returns the saved result for a key, or None if there isn't one (or it can't be read)."""
+        fp = path.join(self.folder, key + ".json")
+
+        try:
+            with open(fp, "r") as f:
+                result = load(f)
+            utime(fp) # mark as recently used
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return result
+
+
+    def store(self, key:str, result:dict):
+        """Save a result, written to a temporary file first so other processes never see half of it."""
+        fp = path.join(self.folder, key + ".json")
+        tmp = f"{fp}.{getpid()}.tmp"
+
+        try:
+            old_size = stat(fp).st_size
+        except OSError: # new entry
+            old_size = 0
+
+        try:
+            with open(tmp, "w") as f:
+                dump(result, f)
+            replace(tmp, fp)
+        except OSError:
+            return
+
+        with self.lock:
+            self.size += stat(fp).st_size - old_size
+            if self.size > self.max_bytes:
+                self.evict()
+
+
+    def evict(self, target=None):
+        """Delete the least recently used entries until the cache is down to 'target' bytes (three quarters of 'max_bytes' by default)."""
+        target = 0.75 * self.max_bytes if target == None else target
+        entries = []
+        for name in listdir(self.folder):
+            if name.endswith(".json"):
+                try:
+                    info = stat(path.join(self.folder, name))
+                    entries.append((info.st_mtime_ns, info.st_size, name))
+                except OSError: # removed by another process
+                    pass
+
+        self.size = sum([size for mtime, size, name in entries])
+        for mtime, size, name in sorted(entries):
+            if self.size <= target:
+                break
+            try:
+                remove(path.join(self.folder, name))
+                self.size -= size
+            except OSError:
+                pass
+
+
+    def clear(self):
+        """Delete every entry."""
+        with self.lock:
+            self.evict(0)
+
+
+class frees:
+    """FreES engine for solving systems of equations."""
+
+    def __init__(self, exprs, accuracy=1E-1000, toolkit={}, method="brent", cache=None, disk_cache=None):
+        """'exprs' is the text of a system, or its parsed lines (as 'frees.from_file' reads them)."""
+        self.toolkit = uar(default_function_toolkit(), toolkit)
+        self.cache = cache
+        self.disk_cache = disk_cache # a 'disk_cache' of whole solutions, checked before solving
+        constants = default_constant_toolkit()
+        units = registry if self.toolkit["convert"] is convert else None # fold conversions between quoted units into numbers
+        parse_key = (exprs, tuple(self.toolkit), registry.mtime) if type(exprs) == str else None
+
+        last = None
+        if cache != None and parse_key != None:
+            with cache.lock:
+                last = (cache.parsed, cache.graph) if cache.parse_key == parse_key else None
+
+        if last != None: # unchanged since the last solve, so reuse its parse and graph (with scheduling of its own, as other threads may be solving it)
+            self.parsed, self.graph = last[0], last[1].copy()
+        else:
+            self.parsed = parse_fr(exprs, constants, units) if type(exprs) == str else list(exprs)
+            self.graph = eqn_graph(self.parsed, self.toolkit)
+            if cache != None and parse_key != None:
+                with cache.lock:
+                    cache.parse_key, cache.parsed, cache.graph = parse_key, self.parsed, self.graph
+
+        if log.isEnabledFor(DEBUG):
+            log.debug("SYSTEM:\n%s", self.exprs)
         self.accuracy = accuracy
+        self.method = method # any key of 'root_finders'
         self.iter_solve = iter_solve
-        self.toolkit = uar(default_function_toolkit(), toolkit)
         self.soln = soln({}, 0, percent_err=0.0)
+        self.guess = {}
+        self.bindings = {}
+        self.cancelled = False
         self.warnings = []
+        self.plan = []
+        self.stats = []
+        self.passes = 0
+        self.samples = {}   # arrays of the inputs drawn and the results found by 'uncertainty'
+        self.summary = {}
+        self.optimum = None # result of the last 'optimize'
+
+        log.info("ACCURACY: %.2E", self.accuracy)
+
+    @classmethod
+    def from_file(cls, fp:str, accuracy=1E-1000, toolkit={}, method="brent", cache=None, disk_cache=None):
+        """Load a system from a .fr file a line at a time ('read_fr'). Its text is never held whole, and only the 
+        lines with equations or flags are kept, so this suits very large generated models."""
+        units = registry if toolkit.get("convert", convert) is convert else None
+        return cls(read_fr(fp, default_constant_toolkit(), units), accuracy, toolkit, method, cache, disk_cache)
+
+
+    @property
+    def lines(self):
+        """The text of each parsed line, as python sees it."""
+        return [line.text for line in self.parsed]
+
+
+    @property
+    def exprs(self):
+        """The whole system as python sees it, one line per parsed line."""
+        return "\n".join(self.lines)
+
+
+    def solve(self, bindings={}, guess={}, progress=None, cancel=None):
+        """Solve the system. 'bindings' fixes the value of variables before solving and 'guess' 
+        gives starting points for the root finders (e.g. the solution at a nearby point).
+        'progress' is called with the number of equations handled so far and the total, and 
+        setting the 'cancel' event (e.g. a threading.Event) stops the solve, leaving a partial solution."""
+        self.soln = soln(dict(bindings), 0, percent_err=0.0)
+        self.bindings = dict(bindings)
+        self.guess = guess
+        self.cancelled = False
+        vals = uar(self.soln.soln, self.toolkit)
+        self.graph.reset()
+        self.warnings = []
+        self.plan = []
+        self.stats = []
+        self.passes = 0 # rounds of single-unknown solving, each ended by a coupled block or the end of the solve
+        done, total = 0, len(self.graph.needs)
+
+        key = None if self.disk_cache == None else self.disk_key()
+        if key != None and self.from_disk(self.disk_cache.lookup(key)):
+            if progress != None:
+                progress(total, total)
+            return
+
+        for var in bindings:
+            self.graph.solved(var)
+
+        while not self.cancelled:
+            self.passes += 1
+            i = self.graph.pop()
+            while i != None:
+                self.record(self.solve_eqn(i, vals), [i])
+                done += 1
+
+                if progress != None:
+                    progress(done, total)
+                if cancel != None and cancel.is_set():
+                    self.cancelled = True
+                    break
+
+                i = self.graph.pop()
+
+            if cancel != None and cancel.is_set(): # (also between blocks, which may follow one another without single equations)
+                self.cancelled = True
+
+            block = None if self.cancelled else self.graph.block() # nothing left with a single unknown, so try the coupled equations
+            if block == None:
+                break
+            
+            block_soln = self.solve_cached(block[0], vals, lambda: self.solve_block(*block, vals))
+            if type(block_soln) == str: # (marked here rather than in 'solve_block', which isn't called when the result was cached)
+                self.graph.given_up.update(block[0])
+            self.record(block_soln, block[0])
+            done += len(block[0])
+
+            if progress != None:
+                progress(done, total)
+
+        for i in [] if self.cancelled else self.graph.stalled(): # report the lines that could never be reduced to a single unknown
+            if i in self.graph.given_up: # (already reported with the rest of a block that didn't converge)
+                continue
+            self.record(solve_line(self.parsed[i], vals, target_dx=self.accuracy), [i])
+
+        if log.isEnabledFor(DEBUG):
+            log.debug("PLAN:\n%s", self.report_plan())
+        self.soln.soln = {item : self.soln.soln[item] for item in self.soln.soln if item not in self.toolkit.keys() and not (item.startswith("__") and item.endswith("__"))}
+
+        if key != None and not self.cancelled:
+            self.disk_cache.store(key, self.to_disk())
+
+
+    def disk_key(self):
+        """Hash of everything the solution depends on, naming its entry in the disk cache."""
+        return self.disk_cache.key({
+            "lines": [(line.number, line.normalized()) for line in self.parsed if not line.is_blank],
+            "accuracy": repr(self.accuracy),
+            "method": self.method,
+            "bindings": self.bindings,
+            "guess": self.guess,
+            "toolkit": sorted(self.toolkit),
+            "units": registry.digest
+        })
+
+
+    def to_disk(self):
+        """The solution and its statistics as JSON-able data, for the disk cache."""
+        return {
+            "soln": self.soln.soln,
+            "duration": self.soln.duration,
+            "percent_err": self.soln.percent_err,
+            "iterations": self.soln.iterations,
+            "evaluations": self.soln.evaluations,
+            "warnings": self.warnings,
+            "plan": self.plan,
+            "stats": self.stats,
+            "passes": self.passes
+        }
+
+
+    def from_disk(self, result):
+        """Take the solution from a disk cache entry. Returns False if there wasn't one."""
+        if result == None:
+            return False
+
+        self.soln = soln(result["soln"], result["duration"], percent_err=result["percent_err"], iterations=result["iterations"], evaluations=result["evaluations"], cached=True)
+        self.warnings = result["warnings"]
+        self.plan = [tuple(step) for step in result["plan"]]
+        self.stats = result["stats"]
+        self.passes = result["passes"]
+
+        for warning in self.warnings:
+            log.warning("%s", warning)
+        log.info("Loaded the solution from %s", self.disk_cache.folder)
+        return True
+
+
+    def solve_eqn(self, i:int, vals:dict):
+        """Solve the equation on line index 'i' for its single unknown."""
+        return self.solve_cached([i], vals, lambda: solve_line(self.parsed[i], vals, target_dx=self.accuracy, method=self.method, guess=self.guess))
+
+
+    def solve_cached(self, eqns:list, vals:dict, solve):
+        """Returns the cached result of solving some equations with the current values of their inputs, or calls 'solve'."""
+        if self.cache == None:
+            return solve()
+
+        inputs = sorted(set([(var, vals[var]) for i in eqns for var in self.graph.needs[i] if var in vals]))
+        key = (tuple([self.parsed[i].normalized() for i in eqns]), tuple(inputs), self.accuracy, self.method, registry.mtime)
+        result = self.cache.lookup(key)
+
+        if result is False:
+            result = solve()
+            self.cache.store(key, result)
+
+        return result
+
+
+    def solve_block(self, eqns:list, variables:list, vals:dict):
+        """Solve a group of coupled equations from the dependency graph simultaneously."""
+        exprs = [(self.graph.parsed[i].exprs[0], self.graph.parsed[i].exprs[1]) for i in eqns]
+        bounds = {self.graph.parsed[i].bound_var: (self.graph.parsed[i].l_bound, self.graph.parsed[i].r_bound) for i in eqns if self.graph.parsed[i].bound_var in variables}
+        
+        block_soln = block_solve(exprs, variables, vals, bounds=bounds, guess=self.guess, target_dx=self.accuracy)
+        
+        lines = "\n   ".join([self.parsed[i].text for i in eqns])
+        if block_soln.rank != None and block_soln.rank < len(variables):
+            return f"Skipped coupled lines that only fix {block_soln.rank} of their {len(variables)} unknowns ({', '.join(variables)}): \n   {lines}"
+        elif not block_soln.converged:
+            return f"Could not converge on coupled lines: \n   {lines}"
+
+        return block_soln
+
+
+    def record(self, line_soln, eqns:list):
+        """Add the result of solving one line (or one block of lines) to the system's solution and statistics."""
+        stat = {
+            "lines": [self.parsed[i].number for i in eqns],
+            "equation": "; ".join([self.parsed[i].text.strip() for i in eqns]),
+            "variables": [],
+            "status": "skipped",
+            "parse_time": sum([self.parsed[i].parse_time for i in eqns]),
+            "solve_time": 0.0,
+            "iterations": 0,
+            "evaluations": 0,
+            "bracket": None,
+            "residual": None,
+            "percent_err": None,
+            "cached": False
+        }
+        self.stats.append(stat)
+
+        if type(line_soln) == str:
+            log.warning("%s", line_soln)
+            self.warnings.append(line_soln)
+            stat["status"] = "warning"
+
+        elif line_soln != None:
+            self.soln.soln.update(line_soln.soln)
+            self.soln.duration += line_soln.duration
+            self.soln.iterations += line_soln.iterations
+            self.soln.evaluations += line_soln.evaluations
+            self.plan.append((self.parsed[eqns[0]].number, "; ".join([self.parsed[i].text for i in eqns]), list(line_soln.soln)))
+            stat.update({
+                "variables": list(line_soln.soln),
+                "status": "solved",
+                "solve_time": line_soln.duration,
+                "iterations": line_soln.iterations,
+                "evaluations": line_soln.evaluations,
+                "bracket": line_soln.bracket,
+                "residual": line_soln.residual,
+                "percent_err": line_soln.percent_err,
+                "cached": line_soln.cached
+            })
+
+            if line_soln.percent_err > self.soln.percent_err: 
+                self.soln.percent_err = line_soln.percent_err 
+
+            for var in line_soln.soln:
+                self.graph.solved(var)
+
+
+    def report_stats(self, n=None):
+        """Returns a table of the per-equation statistics of the last solve, slowest first. 'n' limits the number of rows."""
+        rows = sorted(self.stats, key=lambda stat: stat["solve_time"], reverse=True)[:n]
+        header = f"{self.passes} pass(es), {self.soln.iterations} iterations, {self.soln.evaluations} evaluations, {self.soln.duration:.5f} s\n\n"
+        header += f"{'line':>6}  {'status':<8} {'solve ms':>9} {'parse ms':>9} {'iters':>6} {'evals':>6} {'residual':>10}  equation"
+
+        table = [header]
+        for stat in rows:
+            residual = "" if stat["residual"] == None else f"{stat['residual']:.2E}"
+            cached = " (cached)" if stat["cached"] else ""
+            table.append(f"{stat['lines'][0]:>6}  {stat['status']:<8} {1000*stat['solve_time']:>9.3f} {1000*stat['parse_time']:>9.3f} {stat['iterations']:>6} {stat['evaluations']:>6} {residual:>10}  {stat['equation']}{cached}")
+
+        return "\n".join(table)
+
+
+    def export_stats(self, fp:str):
+        """Write the per-equation statistics of the last solve to a .csv file, or to a .json file with the totals."""
+        with open(fp, "w", newline="") as f:
+
+            if fp.lower().endswith(".csv"):
+                writer = DictWriter(f, fieldnames=list(self.stats[0]) if len(self.stats) > 0 else ["lines"])
+                writer.writeheader()
+                for stat in self.stats:
+                    writer.writerow(uar(dict(stat), {"lines": " ".join(map(str, stat["lines"])), "variables": " ".join(stat["variables"])}))
 
-        print(f"\n\n------------------------------------\n\nACCURACY:\n%.2E" % self.accuracy)
+            else:
+                dump({
+                    "passes": self.passes,
+                    "duration": self.soln.duration,
+                    "iterations": self.soln.iterations,
+                    "evaluations": self.soln.evaluations,
+                    "equations": self.stats
+                }, f, indent=4)
+
+
+    def optimize(self, objective=None, free=None, maximize=False, xtol=1E-6, max_evals=500):
+        """Find the values of the free parameters, within their bounds, that minimize the variable 'objective' 
+        (or maximize it, with 'maximize'). 'free' maps each parameter, which must be one of the system's inputs, 
+        to its (low, high) bounds. Without them, the file's '!minimize <var>' or '!maximize <var>' and 
+        '!free <var> <low> <high>' flags are used. One parameter is searched by 'golden_section' and several 
+        by 'nelder_mead', each evaluation calling the system's solution plan so that its root finds start from 
+        the roots of the evaluation before. 'xtol' is the precision wanted, as a fraction of each parameter's range. 
+        The system is then solved at the optimum. Returns that solution (also left in 'optimum'), with the 
+        optimizer's iterations and evaluations, or None if there is nothing to optimize."""
+        start = time()
+        flags = [(flag, args) for line in self.parsed for flag, args in line.flags]
+
+        if objective == None:
+            objectives = [(flag, args[0]) for flag, args in flags if flag in ("minimize", "maximize") and len(args) > 0]
+            if len(objectives) == 0:
+                return None
+            maximize, objective = objectives[-1][0] == "maximize", objectives[-1][1]
+
+        if free == None:
+            free = {args[0]: (float(args[1]), float(args[2])) for flag, args in flags if flag == "free" and len(args) == 3}
+        if len(free) == 0:
+            raise ValueError(f"Nothing to vary while optimizing {objective}: give a parameter '!free <var> <low> <high>'")
+
+        plan = self.compile_plan()
+        if objective not in self.soln.soln:
+            raise ValueError(f"Can't optimize {objective}, which the system doesn't solve for")
+        fixed = [var for var in free if var not in plan.inputs]
+        if len(fixed) > 0:
+            raise ValueError(f"Only inputs (variables found from values alone) can be varied, not {', '.join(fixed)}")
+
+        names = list(free)
+        lo = [min(free[var]) for var in names]
+        hi = [max(free[var]) for var in names]
+        sign = -1 if maximize else 1
+
+        last = {"soln": self.soln.soln} # latest solution, as a starting point for the final solve
+
+        def f(x):
+            last["soln"] = plan(**dict(zip(names, x)))
+            value = last["soln"].get(objective, float("nan"))
+            return sign * value if isfinite(value) else float("inf")
+
+        if len(names) == 1:
+            x, fx, iterations, evaluations, converged = golden_section(lambda x: f([x]), lo[0], hi[0], xtol * (hi[0] - lo[0]), max_evals)
+            x = [x]
+        else:
+            x0 = [min(max(plan.inputs[var], l), h) for var, l, h in zip(names, lo, hi)]
+            x, fx, iterations, evaluations, converged = nelder_mead(f, x0, lo, hi, xtol, max_evals)
+
+        log.info("%s %s over %s in %d evaluations", "Maximized" if maximize else "Minimized", objective, ", ".join(names), evaluations)
+        self.solve(bindings=dict(zip(names, x)), guess=last["soln"])
+        self.optimum = soln(dict(self.soln.soln), time() - start, percent_err=self.soln.percent_err, converged=converged, iterations=iterations, evaluations=evaluations)
+        return self.optimum
+
+
+    def uncertainty(self, samples=10000, seed=None, percentiles=(2.5, 50, 97.5)):
+        """Propagate the '!dist' distributions of the system's inputs through its solution with 'samples' random 
+        draws, all solved together ('solution_plan.batch'). Returns, for each variable, its mean, standard 
+        deviation, percentiles, the number of draws it couldn't be found for and the first-order sensitivity 
+        index of each uncertain input. Empty if no input has a '!dist' flag."""
+        import numpy as np
+
+        dists = {info.dist_var: info.dist for info in self.graph.parsed.values() if info.dist_var != None}
+        self.samples, self.summary = {}, {}
+        if len(dists) == 0:
+            return self.summary
+
+        plan = self.compile_plan()
+        outputs = [var for var in dists if var not in plan.inputs]
+        if len(outputs) > 0:
+            raise ValueError(f"'!dist' can only be given to inputs (variables found from values alone), not {', '.join(outputs)}")
+
+        rng = np.random.default_rng(seed)
+        draws = {var: draw_samples(dists[var], plan.inputs[var], samples, rng) for var in dists}
+        start = time()
+        self.samples = plan.batch(**draws)
+        log.info("Propagated %d samples in %.3f s", samples, time() - start)
+
+        for var in self.samples:
+            values = self.samples[var]
+            found = np.isfinite(values)
+            if not np.any(found):
+                self.summary[var] = {"mean": None, "std": None, "percentiles": {}, "failed": samples, "sensitivity": {}}
+                continue
+
+            self.summary[var] = {
+                "mean": float(np.mean(values[found])),
+                "std": float(np.std(values[found])),
+                "percentiles": {f"p{p:g}": float(value) for p, value in zip(percentiles, np.percentile(values[found], percentiles))},
+                "failed": int(samples - np.sum(found)),
+                "sensitivity": {name: first_order_index(draws[name][found], values[found]) for name in draws}
+            }
+
+        return self.summary
+
+
+    def report_uncertainty(self):
+        """Returns a table of the last 'uncertainty' summary, one row per variable."""
+        names = list(next(iter(self.summary.values()))["sensitivity"]) if len(self.summary) > 0 else []
+        rows = [f"{'variable':<12}{'mean':>14}{'std':>12}{'percentiles':>44}  sensitivity ({', '.join(names)})"]
+
+        for var, s in self.summary.items():
+            if s["mean"] == None:
+                rows.append(f"{var:<12}{'not found':>14}")
+                continue
+            percentiles = " ".join([f"{p}={value:.5g}" for p, value in s["percentiles"].items()])
+            sensitivity = " ".join([f"{index:.3f}" for index in s["sensitivity"].values()])
+            failed = f" ({s['failed']} failed)" if s["failed"] > 0 else ""
+            rows.append(f"{var:<12}{s['mean']:>14.6g}{s['std']:>12.4g}{percentiles:>44}  {sensitivity}{failed}")
+
+        return "\n".join(rows)
+
+
+    def report_plan(self):
+        """Returns the order in which the last solve found each variable, one line per equation."""
+        return "\n".join([f"{n}: {', '.join(found)} <- {line.strip()}" for n, line, found in self.plan])
+
+
+    def compile_plan(self):
+        """Returns the last solve (solving first if there wasn't one) as a 'solution_plan': a python function 
+        of the system's inputs that repeats the solve's assignments and root finds in the order they were found."""
+        if len(self.stats) == 0:
+            self.solve()
+
+        steps, inputs, blocks, guesses = [], {}, [], []
+        index = {line.number: i for i, line in enumerate(self.parsed)} # statistics give line numbers
+        available = set(self.bindings)
+        inputs.update(self.bindings)
+
+        for stat in self.stats:
+            eqns = [index[n] for n in stat["lines"]]
+            info = self.graph.parsed[eqns[0]]
+
+            if stat["status"] == "warning" and len(eqns) == 1 and info.conditional: # the skipped branch of an '!if' must stay skipped
+                steps.append(("guard", stat["lines"][0], False))
+                continue
+            elif stat["status"] != "solved":
+                continue
+
+            if len(eqns) > 1 or len(stat["variables"]) > 1:
+                variables = stat["variables"]
+                blocks.append({
+                    "exprs": [[self.graph.parsed[i].exprs[0], self.graph.parsed[i].exprs[1]] for i in eqns],
+                    "variables": variables,
+                    "bounds": {self.graph.parsed[i].bound_var: [self.graph.parsed[i].l_bound, self.graph.parsed[i].r_bound] for i in eqns if self.graph.parsed[i].bound_var in variables}
+                })
+                guesses.append({var: self.soln.soln[var] for var in variables})
+                steps.append(("block", len(guesses) - 1, variables, sorted(set([var for i in eqns for var in self.graph.needs[i]]) & available)))
+                available.update(variables)
+                continue
+
+            var = stat["variables"][0]
+            line = self.parsed[eqns[0]]
+
+            if info.conditional:
+                steps.append(("guard", stat["lines"][0], True))
+            elif self.graph.needs[eqns[0]] == {var}: # found from constants alone, so it's one of the plan's inputs
+                inputs[var] = self.soln.soln[var]
+                available.add(var)
+                continue
+
+            func, condition = (line.lhs, line.rhs) if var in line.lhs_names else (line.rhs, line.lhs)
+            bounds = (info.l_bound, info.r_bound) if info.bound_var == var else (-1E20, 1E20)
+            guesses.append(self.soln.soln[var])
+            blocks.append(None)
+            pick = info.root_pick if info.root_var == var else None
+            steps.append(("root", len(guesses) - 1, var, func.strip(), condition.strip(), float(bounds[0]), float(bounds[1]), pick))
+            available.add(var)
+
+        conditions = {self.parsed[i].number: self.graph.parsed[i].flags for i in self.graph.parsed}
+        source = plan_source(steps, inputs, list(self.soln.soln), conditions, set(self.toolkit))
+        return solution_plan(source, inputs, blocks, guesses, self.accuracy, self.method, self.exprs, self.toolkit)
+
+
+
+class stale_plan(Exception):
+    """Raised inside a 'solution_plan' when its inputs take the system down a different '!if' branch than the solve it was compiled from."""
+
+
+_comparisons = {"<": "<", ">": ">", "=": "==", "==": "==", "<=": "<=", ">=": ">=", "/=": "!="}
+
+
+def plan_source(steps:list, inputs:dict, outputs:list, conditions:dict, toolkit:set):
+    """Write the python source of a solution plan. 'steps' are ("root", k, var, func, condition, lo, hi, pick), 
+    ("block", k, variables, known) and ("guard", line number, satisfied) tuples in solving order. Subexpressions 
+    that are computed more than once, or that a root find would re-compute on every iteration, are assigned 
+    to temporaries the first time they can be."""
+    import ast
+
+    def names(node):
+        return set([n.id for n in ast.walk(node) if isinstance(n, ast.Name)])
+
+    def trivial(node):
+        return not isinstance(node, ast.expr) or isinstance(node, (ast.Name, ast.Constant, ast.Lambda)) or (isinstance(node, ast.UnaryOp) and isinstance(node.operand, ast.Constant))
+
+    def opaque(node):
+        return isinstance(node, (ast.IfExp, ast.BoolOp, ast.Lambda)) # parts of these may never be evaluated
+
+    # Parse every step, noting which names are known when it runs
+    available = set(inputs) | toolkit
+    parsed = []
+    for step in steps:
+        if step[0] == "root":
+            kind, k, var, func, condition, lo, hi, pick = step
+            parsed.append((step, set(available), var, ast.parse(func, mode="eval").body, ast.parse(condition, mode="eval").body))
+            available.add(var)
+        elif step[0] == "block":
+            parsed.append((step, set(available), None, None, None))
+            available.update(step[2])
+        else:
+            flag = [args for flag, args in conditions[step[1]] if flag == "if"][0]
+            test = ast.parse(f"({flag[0]}) {_comparisons[flag[1]]} ({flag[2]})", mode="eval").body
+            parsed.append((step, set(available), None, test, None))
+
+    # Count the subexpressions each step could compute up front
+    counts = {}
+    hoist = set()
+
+    def count(node, known, bound, inside):
+        if not trivial(node) and names(node) <= known and bound not in names(node):
+            key = ast.dump(node)
+            counts[key] = counts.get(key, 0) + 1
+            if inside: # only the largest such piece of a root find's function needs lifting out of it
+                hoist.add(key)
+                inside = False
+        if not opaque(node):
+            for child in ast.iter_child_nodes(node):
+                count(child, known, bound, inside)
+
+    for step, known, var, first, second in parsed:
+        if step[0] == "root" and ast.unparse(first) == var:
+            count(second, known, var, False)
+        elif step[0] == "root":
+            count(first, known, var, True)
+            count(second, known, var, False)
+        elif step[0] == "guard":
+            count(first, known, None, False)
+
+    hoist.update([key for key in counts if counts[key] > 1])
+
+    # Rewrite each step with its shared subexpressions replaced by temporaries
+    temps = {}
+    body = []
+
+    def rewrite(node, known, bound):
+        if not trivial(node) and ast.dump(node) in hoist and names(node) <= known and bound not in names(node):
+            key = ast.dump(node)
+            if key not in temps:
+                value = rewrite_children(node, known, bound)
+                temps[key] = f"_c{len(temps)}"
+                body.append(f"{temps[key]} = {ast.unparse(value)}")
+            return ast.Name(id=temps[key], ctx=ast.Load())
+        return rewrite_children(node, known, bound)
+
+    def rewrite_children(node, known, bound):
+        if opaque(node):
+            return node
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, ast.expr):
+                setattr(node, field, rewrite(value, known, bound))
+            elif isinstance(value, list):
+                setattr(node, field, [rewrite(item, known, bound) if isinstance(item, ast.expr) else item for item in value])
+        return node
+
+    for step, known, var, first, second in parsed:
+        if step[0] == "root":
+            kind, k, var, func, condition, lo, hi, pick = step
+            second = ast.unparse(rewrite(second, known, var))
+            if ast.unparse(first) == var: # already explicit
+                body.append(f"{var} = {second}")
+            else:
+                choice = "" if pick == None else f", {pick!r}, {expr_degree(func, var) if expr_form(func, var) == 'polynomial' else None}"
+                body.append(f"{var} = _root({k}, lambda {var}: {ast.unparse(rewrite(first, known, var))}, {second}, {lo!r}, {hi!r}{choice})")
+
+        elif step[0] == "block":
+            kind, k, variables, needed = step
+            body.append(f"{', '.join(variables)}{',' if len(variables) == 1 else ''} = _block({k}, {{{', '.join([f'{name!r}: {name}' for name in needed])}}})")
+
+        elif names(first) <= known:
+            kind, i, satisfied = step
+            test = ast.unparse(rewrite(first, known, None))
+            body.append(f"if {'not ' if satisfied else ''}({test}): raise _stale({i})")
+
+    args = ", ".join([f"{var}={inputs[var]!r}" for var in inputs])
+    result = ", ".join([f"{var!r}: {var}" for var in outputs])
+    return "\n    ".join([f"def plan({args}):"] + body + [f"return {{{result}}}"]) + "\n"
+
+
+class solution_plan:
+    """A solved system compiled into one straight-line python function of its inputs (the variables given by 
+    bindings or by lines without other variables). Calling the plan with new values for some of its inputs 
+    returns the whole solution. Each root find starts from the value it found on the previous call. 
+    If the inputs change which '!if' lines apply, the system is solved from scratch instead."""
+
+    def __init__(self, source:str, inputs:dict, blocks=[], guesses=[], accuracy=1E-1000, method="brent", exprs="", toolkit={}):
+        self.source = source
+        self.inputs = inputs        # input variable -> value in the solve the plan was made from
+        self.blocks = blocks        # equations, variables and bounds of each coupled block (None for single root finds)
+        self.guesses = guesses      # last value found by each root find (or dict of values, for blocks)
+        self.accuracy = accuracy
+        self.method = method
+        self.exprs = exprs          # the system itself, for the full solve when the plan doesn't apply
+        self.toolkit = uar(default_function_toolkit(), toolkit)
+        self.fallbacks = 0
+        self.compile()
 
-    def solve(self):
-        solution_in_progress = True
-        
-        while solution_in_progress:
-            number_of_known_values = len(self.soln.soln)
-            self.warnings = []
-            
-            for line in self.lines:
-                # line_number = self.lines.index(line) + 1
-                line_soln = solve_line(line, uar(self.soln.soln, self.toolkit), target_dx=self.accuracy)
 
-                if type(line_soln) == str:
-                    print(f"\n\n------------------------------------\n\nWARNING: {line_soln}")
-                    self.warnings.append(line_soln)
+    def compile(self):
+        namespace = uar(dict(self.toolkit), {"_root": self.root, "_block": self.block, "_stale": stale_plan, "inf": float("inf"), "nan": float("nan")})
+        exec(compile(self.source, "<frees plan>", "exec"), namespace)
+        self.function = namespace["plan"]
+        self.batch_function = None # compiled on first use by 'batch'
 
-                elif line_soln != None:
-                    self.soln.soln.update(line_soln.soln)
-                    self.soln.duration += line_soln.duration
 
-                    if line_soln.percent_err > self.soln.percent_err: 
-                        self.soln.percent_err = line_soln.percent_err 
-            
-            if len(self.soln.soln) == number_of_known_values: # no new solutions have been found this loop, so break and report results.
-                self.soln.soln = {item : self.soln.soln[item] for item in self.soln.soln if item not in self.toolkit.keys() and item != '__builtins__'}
-                
-                solution_in_progress = False
+    def __call__(self, **inputs):
+        try:
+            return self.function(**inputs)
+        except (stale_plan, OverflowError, ZeroDivisionError, ValueError):
+            self.fallbacks += 1
+            system = frees(self.exprs, self.accuracy, self.toolkit, self.method)
+            system.solve(bindings=uar(dict(self.inputs), inputs))
+            return system.soln.soln
+
+
+    def root(self, k:int, f, condition:float, lo:float, hi:float, pick=None, degree=None):
+        if pick != None: # a '!root' line, so find all of the roots again and choose the same way
+            x = select_root(find_roots(f, condition, lo, hi, self.accuracy, self.method, degree=degree)[0], pick)
+            if x == None:
+                raise stale_plan(pick)
+        else:
+            root_soln = root_solve(f, condition, "x", lo, hi, self.accuracy, method=self.method, guess=self.guesses[k])
+            if not root_soln.converged: # so the full solve can say why, rather than carrying on from a bad root
+                raise stale_plan(k)
+            x = root_soln.soln["x"]
+        self.guesses[k] = x
+        return x
+
+
+    def block(self, k:int, known:dict):
+        block = self.blocks[k]
+        block_soln = block_solve(block["exprs"], block["variables"], uar(dict(self.toolkit), known), bounds=block["bounds"], guess=self.guesses[k], target_dx=self.accuracy)
+        if not block_soln.converged:
+            raise stale_plan(block["exprs"])
+
+        self.guesses[k] = block_soln.soln
+        return tuple([block_soln.soln[var] for var in block["variables"]])
+
+
+    def batch(self, **inputs):
+        """Evaluate the plan for whole arrays of inputs at once, with each root find solved for every element 
+        together ('batch_root_solve'). Returns a dict of arrays, with nan where a root wasn't found. Plans that 
+        can't be evaluated that way (with coupled blocks, '!root' choices or '!if' branches that depend on the 
+        arrays) are called an element at a time instead."""
+        import numpy as np
+
+        arrays = {var: np.asarray(inputs[var], dtype=float) for var in inputs}
+        shape = np.broadcast(*arrays.values()).shape if len(arrays) > 0 else ()
+
+        if self.batch_function == None:
+            toolkit = uar(numpy_function_toolkit(), {name: f for name, f in self.toolkit.items() if name not in default_function_toolkit()})
+            namespace = uar(toolkit, {"_root": self.batch_root, "_block": self.batch_block, "_stale": stale_plan, "inf": float("inf"), "nan": float("nan")})
+            exec(compile(self.source, "<frees plan>", "exec"), namespace)
+            self.batch_function = namespace["plan"]
+
+        try:
+            with np.errstate(all="ignore"):
+                result = self.batch_function(**arrays)
+        except (stale_plan, TypeError, ValueError, OverflowError, ZeroDivisionError):
+            log.info("Plan can't be evaluated on whole arrays, so evaluating it one element at a time")
+            columns = {var: np.broadcast_to(arrays[var], shape).ravel() for var in arrays}
+            rows = [self(**{var: float(columns[var][n]) for var in columns}) for n in range(int(np.prod(shape)))]
+            outputs = list(dict.fromkeys([var for row in rows for var in row]))
+            result = {var: np.array([row.get(var, np.nan) for row in rows], dtype=float).reshape(shape) for var in outputs}
+
+        return {var: np.broadcast_to(np.asarray(result[var], dtype=float), shape) for var in result}
+
+
+    def batch_root(self, k:int, f, condition, lo:float, hi:float, pick=None, degree=None):
+        import numpy as np
+
+        if pick != None: # choosing among the roots of each element isn't vectorized
+            raise stale_plan(pick)
+
+        root_soln = batch_root_solve(f, condition, "x", lo, hi, self.accuracy, guess=self.guesses[k])
+        return np.where(root_soln.converged, root_soln.soln["x"], np.nan)
+
+
+    def batch_block(self, k:int, known:dict):
+        raise stale_plan(self.blocks[k]["exprs"])
+
+
+    def __getstate__(self):
+        """The compiled function and the toolkit don't pickle, so plans are pickled as their source."""
+        state = dict(self.__dict__)
+        del state["function"], state["batch_function"], state["toolkit"]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.toolkit = default_function_toolkit()
+        self.compile()
+
+
+    def save(self, fp:str):
+        """Write the plan to a .json file that 'load_plan' can read back."""
+        with open(fp, "w") as f:
+            dump({
+                "source": self.source,
+                "inputs": self.inputs,
+                "blocks": self.blocks,
+                "guesses": self.guesses,
+                "accuracy": self.accuracy,
+                "method": self.method,
+                "exprs": self.exprs
+            }, f, indent=4)
+
+
+def load_plan(fp:str, toolkit={}):
+    """Read a plan written by 'solution_plan.save'. 'toolkit' supplies any functions beyond the default ones."""
+    with open(fp, "r") as f:
+        state = load(f)
+
+    return solution_plan(state["source"], state["inputs"], state["blocks"], state["guesses"], state["accuracy"], state["method"], state["exprs"], toolkit)
+
+
+def draw_samples(dist:list, nominal:float, n:int, rng):
+    """Draw n samples of a variable from the arguments of its '!dist' flag: "normal [<mean>] <sd>", 
+    "uniform <low> <high>", "triangular <low> <mode> <high>" or "tol <half width>" (uniform about its 
+    nominal value). A normal distribution without a mean is centred on the nominal value."""
+    counts = {"normal": (1, 2), "uniform": (2,), "triangular": (3,), "tol": (1,)}
+    if len(dist) == 0 or dist[0] not in counts or len(dist) - 1 not in counts[dist[0]]:
+        raise ValueError(f"'!dist' takes normal [<mean>] <sd>, uniform <low> <high>, triangular <low> <mode> <high> or tol <half width>, not '{' '.join(dist)}'")
+
+    args = [float(arg) for arg in dist[1:]]
+    if dist[0] == "normal":
+        return rng.normal(nominal if len(args) == 1 else args[0], args[-1], n)
+    elif dist[0] == "uniform":
+        return rng.uniform(args[0], args[1], n)
+    elif dist[0] == "triangular":
+        return rng.triangular(args[0], args[1], args[2], n)
+    return rng.uniform(nominal - args[0], nominal + args[0], n)
+
+
+def first_order_index(x, y, bins=None):
+    """Estimate the share of the variance of y that x explains on its own (its first-order Sobol index) from 
+    the variance of the means of y over bins holding equal numbers of samples of x."""
+    import numpy as np
+
+    variance = np.var(y)
+    if len(y) < 2 or not variance > 0:
+        return 0.0
+
+    bins = max(1, min(50, len(y) // 20)) if bins == None else bins
+    groups = np.array_split(y[np.argsort(x, kind="stable")], bins)
+    between = sum([len(group) * (group.mean() - y.mean())**2 for group in groups]) / len(y)
+    return float(min(between / variance, 1.0))
+
+
+def golden_section(f, lo:float, hi:float, xtol:float, max_evals=200, grid=9):
+    """Minimize f(x) over [lo, hi]. The best of a coarse grid of points is narrowed down by golden-section search 
+    between its neighbours, so that a function with several dips still ends up in the lowest one. 
+    Returns (x, f(x), iterations, evaluations, converged)."""
+    xs = [lo + (hi - lo) * i / (grid - 1) for i in range(grid)]
+    fs = [f(x) for x in xs]
+    i = min(range(grid), key=lambda i: fs[i])
+    a, b = xs[max(i - 1, 0)], xs[min(i + 1, grid - 1)]
+
+    r = (5**0.5 - 1) / 2
+    c, d = b - r*(b - a), a + r*(b - a)
+    fc, fd = f(c), f(d)
+    iterations, evaluations = 0, grid + 2
+
+    while b - a > xtol + 4*EPS*abs(c) and evaluations < max_evals:
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - r*(b - a)
+            fc = f(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + r*(b - a)
+            fd = f(d)
+        iterations += 1
+        evaluations += 1
+
+    x, fx = min([(xs[i], fs[i]), (c, fc), (d, fd)], key=lambda point: point[1])
+    return x, fx, iterations, evaluations, b - a <= xtol + 4*EPS*abs(x)
+
+
+def nelder_mead(f, x0:list, lo:list, hi:list, xtol:float, max_evals=500):
+    """Minimize f(x) over the box between 'lo' and 'hi' by the Nelder-Mead simplex method, starting from 'x0'. 
+    Points are scaled so the box is a unit cube, and kept inside it. 'xtol' is the size of simplex to stop at, 
+    as a fraction of the box. Returns (x, f(x), iterations, evaluations, converged)."""
+    n = len(x0)
+    evaluations = 0
+
+    def g(u):
+        nonlocal evaluations
+        evaluations += 1
+        return f([l + min(max(ui, 0.0), 1.0) * (h - l) for ui, l, h in zip(u, lo, hi)])
+
+    u0 = [(x - l) / (h - l) if h > l else 0.0 for x, l, h in zip(x0, lo, hi)]
+    simplex = [u0] + [[ui + (0.1 if j == i and ui <= 0.9 else -0.1 if j == i else 0.0) for j, ui in enumerate(u0)] for i in range(n)]
+    simplex = [[min(max(ui, 0.0), 1.0) for ui in u] for u in simplex]
+    values = [g(u) for u in simplex]
+    iterations = 0
+
+    def size():
+        return max([abs(a - b) for u in simplex[1:] for a, b in zip(u, simplex[0])])
+
+    while size() > xtol and evaluations < max_evals:
+        iterations += 1
+        order = sorted(range(n + 1), key=lambda i: values[i])
+        simplex, values = [simplex[i] for i in order], [values[i] for i in order]
+        centroid = [sum([u[j] for u in simplex[:-1]]) / n for j in range(n)]
+
+        def towards(factor):
+            return [min(max(c + factor * (c - w), 0.0), 1.0) for c, w in zip(centroid, simplex[-1])]
+
+        reflected = towards(1.0)
+        fr = g(reflected)
+        if fr < values[0]:
+            expanded = towards(2.0)
+            fe = g(expanded)
+            simplex[-1], values[-1] = (expanded, fe) if fe < fr else (reflected, fr)
+        elif fr < values[-2]:
+            simplex[-1], values[-1] = reflected, fr
+        else:
+            contracted = towards(0.5) if fr < values[-1] else towards(-0.5)
+            fc = g(contracted)
+            if fc < min(fr, values[-1]):
+                simplex[-1], values[-1] = contracted, fc
+            else: # shrink everything towards the best point
+                simplex = [simplex[0]] + [[b + 0.5 * (a - b) for a, b in zip(u, simplex[0])] for u in simplex[1:]]
+                values = [values[0]] + [g(u) for u in simplex[1:]]
+
+    best = min(range(n + 1), key=lambda i: values[i])
+    x = [l + min(max(ui, 0.0), 1.0) * (h - l) for ui, l, h in zip(simplex[best], lo, hi)]
+    return x, values[best], iterations, evaluations, size() <= xtol
+
+
+def sweep(exprs:str, ind_var:str, domain:list, dep_vars:list, accuracy=1E-1000, progress=None, cancel=None, disk_cache=None):
+    """Solve a system at each value of 'ind_var' in 'domain'. The system is parsed and planned once, and 
+    each point starts its root finders from the solution at the previous point. 
+    Returns a dict of numpy arrays for 'ind_var' and each of 'dep_vars' (nan where a variable wasn't found).
+    If the 'cancel' event is set, the arrays stop at the last point that was fully solved. 
+    Points found in 'disk_cache' (from an earlier identical sweep) are loaded instead of solved."""
+    import numpy as np
+
+    system = frees(exprs, accuracy, disk_cache=disk_cache)
+    results = {var: [] for var in dep_vars}
+    guess = {}
+
+    for n, x in enumerate(domain):
+        system.solve(bindings={ind_var: x}, guess=guess, cancel=cancel)
+        guess = system.soln.soln
+
+        if system.cancelled:
+            domain = domain[:n]
+            break
+
+        for var in dep_vars:
+            results[var].append(system.soln.soln.get(var, np.nan))
+
+        if progress != None:
+            progress(n + 1, len(domain))
+
+    return uar({var: np.array(results[var], dtype=float) for var in dep_vars}, {ind_var: np.array(domain, dtype=float)})
+
+
+SWEEP_CHUNK = 4096 # grid points 'grid_sweep' solves together, and saves at a time
+
+
+def grid_sweep(exprs:str, axes:dict, dep_vars:list, folder=None, accuracy=1E-1000, chunk=SWEEP_CHUNK, progress=None, cancel=None):
+    """Solve a system at every point of the grid spanned by 'axes', a dict of the values of each independent variable. 
+    The system is planned once, at the first point, and the plan is evaluated for 'chunk' points at a time 
+    ('solution_plan.batch'). Returns a dict of arrays shaped like the grid (one axis per independent variable, 
+    in order) for the independent variables and each of 'dep_vars', with nan where a variable wasn't found 
+    or the sweep didn't reach. With 'folder', the results are kept in .npy files there, saved after each chunk, 
+    and the arrays returned are mapped from them rather than held in memory. Calling this again with the same 
+    arguments resumes an interrupted sweep from its last saved chunk. Setting the 'cancel' event stops the sweep 
+    after the current chunk."""
+    import numpy as np
+    from hashlib import sha256
+
+    names = list(axes)
+    values = [np.asarray(axes[var], dtype=float).ravel() for var in names]
+    shape = tuple([len(v) for v in values])
+    total = int(np.prod(shape))
+    chunks = -(-total // chunk)
+    done = 0
+
+    if folder == None:
+        results = {var: np.full(shape, np.nan) for var in dep_vars}
+    else:
+        makedirs(folder, exist_ok=True)
+        fp = path.join(folder, "sweep.json")
+        state = {
+            "key": sha256(dumps([exprs, repr(accuracy), [v.tolist() for v in values], chunk]).encode()).hexdigest(),
+            "axes": {var: v.tolist() for var, v in zip(names, values)},
+            "dep_vars": list(dep_vars),
+            "done": 0
+        }
+
+        def save_state():
+            tmp = f"{fp}.{getpid()}.tmp"
+            with open(tmp, "w") as f:
+                dump(state, f)
+            replace(tmp, fp) # so an interruption never leaves half a state file
+
+        resumed = None
+        if path.exists(fp):
+            with open(fp, "r") as f:
+                resumed = load(f)
+            if resumed["key"] != state["key"] or resumed["axes"] != state["axes"] or resumed["dep_vars"] != state["dep_vars"]:
+                raise ValueError(f"{folder} holds a different sweep, so it can't be resumed. Delete it or sweep into another folder")
+            done = state["done"] = resumed["done"]
+
+        results = {var: np.lib.format.open_memmap(path.join(folder, f"{var}.npy"), mode="r+" if resumed != None else "w+", dtype=float, shape=shape) for var in dep_vars}
+        if resumed == None:
+            for var in dep_vars:
+                results[var][...] = np.nan
+                results[var].flush()
+            save_state()
+        elif done > 0:
+            log.info("Resuming sweep in %s at point %d of %d", folder, min(done * chunk, total), total)
+
+    flat = {var: results[var].reshape(-1) for var in dep_vars}
+    plan = None
+
+    for k in range(done, chunks):
+        if cancel != None and cancel.is_set():
+            break
+
+        start, stop = k * chunk, min((k + 1) * chunk, total)
+        point = np.unravel_index(np.arange(start, stop), shape)
+        inputs = {var: v[i] for var, v, i in zip(names, values, point)}
+
+        if plan == None:
+            system = frees(exprs, accuracy)
+            system.solve(bindings={var: float(inputs[var][0]) for var in names})
+            plan = system.compile_plan()
+
+        found = plan.batch(**inputs)
+        for var in dep_vars:
+            flat[var][start:stop] = found.get(var, np.nan)
+
+        if folder != None:
+            for var in dep_vars:
+                results[var].flush()
+            state["done"] = k + 1
+            save_state()
+
+        if progress != None:
+            progress(stop, total)
+
+    grid = {var: np.broadcast_to(v.reshape([-1 if j == i else 1 for j in range(len(shape))]), shape) for i, (var, v) in enumerate(zip(names, values))}
+    return uar(grid, results)
+
+
+def plot_grid(results:dict, axes:list, var:str, kind="contour", title="", at={}, fp=None):
+    """Plot 'var' from a 'grid_sweep' over the first two of its independent variables 'axes', as filled contours 
+    or (with kind "heatmap") as coloured cells. Any further independent variables are held at their index in 
+    'at' (the middle of their range by default). Shows the plot, or saves it to 'fp' if one is given."""
+    from matplotlib import pyplot as plt # slow to import, and only needed for plots
+
+    index = tuple([slice(None) if i < 2 else at.get(name, results[var].shape[i] // 2) for i, name in enumerate(axes)])
+    x, y, z = results[axes[0]][index], results[axes[1]][index], results[var][index]
+
+    figure, ax = plt.subplots()
+    if kind == "heatmap":
+        mesh = ax.pcolormesh(x, y, z, shading="nearest")
+    else:
+        mesh = ax.contourf(x, y, z, levels=20)
+        ax.contour(x, y, z, levels=mesh.levels, colors="k", linewidths=0.5)
+
+    figure.colorbar(mesh, ax=ax, label=var)
+    ax.set_xlabel(axes[0])
+    ax.set_ylabel(axes[1])
+    ax.set_title(title)
+
+    if fp != None:
+        figure.savefig(fp)
+        plt.close(figure)
+    else:
+        plt.show()